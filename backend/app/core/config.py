@@ -15,6 +15,67 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Gmail API
+    GMAIL_BATCH_SIZE: int = 100  # subrequisições por batch (máximo 100)
+    GMAIL_BATCH_MAX_RETRIES: int = 3
+    GMAIL_MAX_INFLIGHT_PER_USER: int = 10
+    GMAIL_PAGE_SIZE: int = 100
+    # Cota por usuário: 250 unidades/s; ficamos logo abaixo
+    GMAIL_QUOTA_UNITS_PER_SECOND: float = 235.0
+    GMAIL_QUOTA_BURST: float = 250.0
+    GMAIL_MAX_RETRIES: int = 5
+    GMAIL_BACKOFF_BASE: float = 0.5
+    GMAIL_BACKOFF_MAX: float = 32.0
+    
+    # Cliente HTTP compartilhado
+    HTTP2_ENABLED: bool = True
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_TIMEOUT: float = 30.0
+    
+    # Análise em lote
+    AI_BATCH_CONCURRENCY: int = 8
+    AI_BATCH_ITEM_TIMEOUT: float = 30.0
+    AI_BATCH_MAX_ITEMS: int = 5000
+    # Modo empacotado: vários emails por chamada ao modelo
+    AI_PACKED_INPUT_TOKENS: int = 6000
+    AI_PACKED_OUTPUT_TOKENS: int = 4096
+    AI_PACKED_MAX_ITEMS: int = 25
+    # Análise na ingestão: emails novos analisados uma vez após cada sync
+    AI_INGEST_ANALYSIS: bool = True
+    AI_INGEST_MAX_ITEMS: int = 500
+    # Corpos baixados por rodada de ingestão (a listagem traz só metadados)
+    AI_INGEST_HYDRATE_MAX_ITEMS: int = 500
+    # Insights em map-reduce: emails por bloco e resumos por etapa de junção
+    AI_INSIGHTS_CHUNK_SIZE: int = 200
+    AI_INSIGHTS_MERGE_FANOUT: int = 20
+    # Contexto do chat: orçamento de tokens, tamanho máximo de trecho e emails candidatos
+    AI_CHAT_CONTEXT_TOKENS: int = 3000
+    AI_CHAT_PASSAGE_TOKENS: int = 250
+    AI_CHAT_CANDIDATES: int = 10
+    # Cache semântico de respostas do chat (similaridade mínima do embedding da pergunta)
+    CHAT_CACHE_SIMILARITY: float = 0.95
+    CHAT_CACHE_TTL_SECONDS: int = 3600
+    CHAT_CACHE_MAX_ENTRIES_PER_USER: int = 200
+    CHAT_CACHE_MAX_USERS: int = 1000
+    
+    # Cache de análises de IA
+    ANALYSIS_CACHE_MAX_ENTRIES: int = 50000
+    ANALYSIS_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    ANALYSIS_CACHE_MEMORY_ENTRIES: int = 5000
+    INSIGHTS_CACHE_MAX_ENTRIES: int = 2000
+    
+    # Armazenamento local
+    DATABASE_PATH: str = "data/emails.db"
+    
+    # Índice de embeddings (matriz NumPy em data/vectors.npy + data/vectors.json)
+    VECTOR_INDEX_PATH: str = "data/vectors"
+    EMBEDDING_MODEL: str = "models/text-embedding-004"
+    EMBEDDING_BATCH_SIZE: int = 100
+    EMBEDDING_MAX_CHARS: int = 2000
+    # Busca híbrida: peso da similaridade vetorial (o restante vai para o BM25)
+    HYBRID_VECTOR_WEIGHT: float = 0.6
+    HYBRID_CANDIDATES_FACTOR: int = 5
+    
     # ChromaDB
     CHROMADB_HOST: str = "localhost"
     CHROMADB_PORT: int = 8001
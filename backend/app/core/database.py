@@ -1,36 +1,501 @@
 """
 Configuração do banco de dados
 """
-from typing import Optional
+from typing import Optional, List, Dict, Any, Iterable, Iterator
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+import json
 import os
 
-# Por enquanto, vamos usar um sistema simples de armazenamento
-# em arquivo JSON para os emails
+from app.core.config import settings
+
+# Os emails ficam em um SQLite indexado (data/emails.db). Cada mensagem é
+# uma linha; escritas fazem upsert por id e só tocam as linhas alteradas.
+
+EMAILS_FILE = "data/emails.json"  # formato legado, importado uma única vez
+DATABASE_PATH = settings.DATABASE_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    date_ts REAL,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_emails_thread ON emails (thread_id);
+CREATE INDEX IF NOT EXISTS idx_emails_date ON emails (date_ts);
+
+CREATE TABLE IF NOT EXISTS email_labels (
+    email_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (email_id, label)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_email_labels_label ON email_labels (label, email_id);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_key TEXT PRIMARY KEY,
+    history_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_lru ON analysis_cache (namespace, accessed_at);
+
+CREATE TABLE IF NOT EXISTS email_analysis (
+    email_id TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    categoria TEXT,
+    sentimento TEXT,
+    urgencia TEXT,
+    data TEXT NOT NULL,
+    analyzed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_analysis_categoria ON email_analysis (categoria);
+CREATE INDEX IF NOT EXISTS idx_email_analysis_sentimento ON email_analysis (sentimento);
+CREATE INDEX IF NOT EXISTS idx_email_analysis_urgencia ON email_analysis (urgencia);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
 
-EMAILS_FILE = "data/emails.json"
 
 def ensure_data_directory():
     """Garante que o diretório de dados existe"""
-    os.makedirs("data", exist_ok=True)
+    os.makedirs(os.path.dirname(DATABASE_PATH) or "data", exist_ok=True)
+
+
+def get_connection() -> sqlite3.Connection:
+    """Retorna a conexão SQLite compartilhada pelo processo"""
+    global _connection
+    with _lock:
+        if _connection is None:
+            ensure_data_directory()
+            conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _connection = conn
+            _import_legacy_json(conn)
+        return _connection
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Conexão compartilhada, sob o lock do processo, dentro de uma transação"""
+    conn = get_connection()
+    with _lock, conn:
+        yield conn
+
+
+def close_connection():
+    """Fecha a conexão compartilhada (usado no shutdown)"""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
 
 def get_emails_collection():
-    """Retorna uma referência para a coleção de emails (simulada)"""
-    ensure_data_directory()
-    return {"file": EMAILS_FILE}
+    """Retorna uma referência para a coleção de emails"""
+    get_connection()
+    return {"file": DATABASE_PATH, "table": "emails"}
 
-def save_emails(emails: list):
-    """Salva emails em arquivo JSON"""
-    import json
-    ensure_data_directory()
-    with open(EMAILS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(emails, f, ensure_ascii=False, indent=2)
 
-def load_emails() -> list:
-    """Carrega emails do arquivo JSON"""
-    import json
-    ensure_data_directory()
+def _parse_date(value: str) -> Optional[float]:
+    """Converte o cabeçalho Date (RFC 2822) em timestamp"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _to_row(email: Dict[str, Any]) -> tuple:
+    """Converte o dicionário do email na linha da tabela"""
+    # O corpo fica em coluna própria: mensagens listadas só com metadados
+    # chegam com body None e não apagam um corpo já baixado
+    data = {k: v for k, v in email.items() if k not in ('body', 'bodyLoaded')}
+    data_json = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    body = email.get('body')
+    if body is not None and email.get('bodyLoaded') is False:
+        body = None
+    digest = hashlib.sha1(data_json.encode('utf-8'))
+    return (
+        email['id'],
+        email.get('threadId'),
+        _parse_date(email.get('date', '')),
+        1 if email.get('isRead') else 0,
+        digest.hexdigest(),
+        data_json,
+        body,
+    )
+
+
+def _from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    """Converte uma linha da tabela de volta no dicionário do email"""
+    email = json.loads(row['data'])
+    email['body'] = row['body'] or ''
+    email['bodyLoaded'] = row['body'] is not None
+    return email
+
+
+def _bump_version(conn: sqlite3.Connection):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('version', '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+
+def _upsert(conn: sqlite3.Connection, emails: Iterable[Dict[str, Any]]) -> int:
+    """Faz upsert por id; retorna quantas linhas realmente mudaram"""
+    changed = 0
+    for email in emails:
+        if not email.get('id'):
+            continue
+        cursor = conn.execute(
+            """
+            INSERT INTO emails (id, thread_id, date_ts, is_read, content_hash, data, body)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                thread_id = excluded.thread_id,
+                date_ts = excluded.date_ts,
+                is_read = excluded.is_read,
+                content_hash = excluded.content_hash,
+                data = excluded.data,
+                body = COALESCE(excluded.body, emails.body)
+            WHERE emails.content_hash != excluded.content_hash
+               OR (excluded.body IS NOT NULL AND emails.body IS NOT excluded.body)
+            """,
+            _to_row(email)
+        )
+        if cursor.rowcount:
+            changed += 1
+            conn.execute("DELETE FROM email_labels WHERE email_id = ?", (email['id'],))
+            conn.executemany(
+                "INSERT OR IGNORE INTO email_labels (email_id, label) VALUES (?, ?)",
+                [(email['id'], label) for label in email.get('labels', [])]
+            )
+    return changed
+
+
+def _import_legacy_json(conn: sqlite3.Connection):
+    """Importa o antigo data/emails.json na primeira abertura do banco"""
+    if not os.path.exists(EMAILS_FILE):
+        return
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+        return
     try:
         with open(EMAILS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return [] 
\ No newline at end of file
+            emails = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao importar {EMAILS_FILE}: {e}")
+        emails = []
+    with conn:
+        if _upsert(conn, emails):
+            _bump_version(conn)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', '1')")
+
+
+def save_emails(emails: list) -> int:
+    """Salva emails (upsert por id); retorna o número de linhas alteradas"""
+    conn = get_connection()
+    with _lock, conn:
+        changed = _upsert(conn, emails)
+        if changed:
+            _bump_version(conn)
+    return changed
+
+
+def _set_labels(email: Dict[str, Any], labels: List[str]):
+    """Atualiza as labels e as flags derivadas delas"""
+    email['labels'] = labels
+    email['isRead'] = 'UNREAD' not in labels
+    email['isImportant'] = 'IMPORTANT' in labels
+
+
+def update_labels(label_map: Dict[str, List[str]]) -> int:
+    """Substitui as labels de emails já armazenados"""
+    if not label_map:
+        return 0
+    conn = get_connection()
+    with _lock, conn:
+        emails = _select_by_ids(conn, list(label_map))
+        for email_id, email in emails.items():
+            _set_labels(email, list(label_map[email_id]))
+        changed = _upsert(conn, emails.values())
+        if changed:
+            _bump_version(conn)
+    return changed
+
+
+def modify_labels(
+    email_ids: List[str],
+    add_labels: Optional[List[str]] = None,
+    remove_labels: Optional[List[str]] = None
+) -> int:
+    """Adiciona/remove labels de vários emails numa única transação"""
+    if not email_ids:
+        return 0
+    add = list(add_labels or [])
+    remove = set(remove_labels or [])
+    conn = get_connection()
+    with _lock, conn:
+        emails = _select_by_ids(conn, email_ids)
+        for email in emails.values():
+            labels = [label for label in email.get('labels', []) if label not in remove]
+            labels += [label for label in add if label not in labels]
+            _set_labels(email, labels)
+        changed = _upsert(conn, emails.values())
+        if changed:
+            _bump_version(conn)
+    return changed
+
+
+def delete_emails(email_ids: List[str]) -> int:
+    """Remove emails pelo id"""
+    if not email_ids:
+        return 0
+    conn = get_connection()
+    ids = list(email_ids)
+    placeholders = ",".join("?" * len(ids))
+    with _lock, conn:
+        conn.execute(f"DELETE FROM email_labels WHERE email_id IN ({placeholders})", ids)
+        conn.execute(f"DELETE FROM email_analysis WHERE email_id IN ({placeholders})", ids)
+        deleted = conn.execute(f"DELETE FROM emails WHERE id IN ({placeholders})", ids).rowcount
+        if deleted:
+            _bump_version(conn)
+    return deleted
+
+
+def load_emails() -> list:
+    """Carrega todos os emails, do mais recente para o mais antigo"""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            "SELECT data, body FROM emails ORDER BY date_ts DESC"
+        ).fetchall()
+    return [_from_row(row) for row in rows]
+
+
+def get_email_by_id(email_id: str) -> Optional[Dict[str, Any]]:
+    """Busca um email pelo id"""
+    conn = get_connection()
+    with _lock:
+        row = conn.execute(
+            "SELECT data, body FROM emails WHERE id = ?", (email_id,)
+        ).fetchone()
+    return _from_row(row) if row else None
+
+
+def _select_by_ids(conn: sqlite3.Connection, email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    ids = list(dict.fromkeys(email_ids))
+    found = {}
+    # Respeita o limite de variáveis do SQLite em lotes grandes
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT id, data, body FROM emails WHERE id IN ({placeholders})", chunk
+        ):
+            found[row['id']] = _from_row(row)
+    return found
+
+
+def get_emails_by_ids(email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Busca vários emails pelo id; retorna um dicionário id -> email"""
+    if not email_ids:
+        return {}
+    conn = get_connection()
+    with _lock:
+        return _select_by_ids(conn, email_ids)
+
+
+def get_emails_by_thread(thread_id: str) -> List[Dict[str, Any]]:
+    """Busca todos os emails de uma thread, em ordem cronológica"""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            "SELECT data, body FROM emails WHERE thread_id = ? ORDER BY date_ts",
+            (thread_id,)
+        ).fetchall()
+    return [_from_row(row) for row in rows]
+
+
+def query_emails(
+    label: Optional[str] = None,
+    date_from: Optional[float] = None,
+    date_to: Optional[float] = None,
+    limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Consulta emails por label e/ou intervalo de datas (timestamps)"""
+    sql = "SELECT e.data, e.body FROM emails e"
+    clauses, params = [], []
+    if label:
+        sql += " JOIN email_labels l ON l.email_id = e.id"
+        clauses.append("l.label = ?")
+        params.append(label)
+    if date_from is not None:
+        clauses.append("e.date_ts >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        clauses.append("e.date_ts < ?")
+        params.append(date_to)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY e.date_ts DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(sql, params).fetchall()
+    return [_from_row(row) for row in rows]
+
+
+def count_emails() -> int:
+    """Número de emails armazenados"""
+    conn = get_connection()
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+
+
+def get_store_version() -> int:
+    """Versão do armazenamento; incrementada a cada escrita que altera linhas"""
+    conn = get_connection()
+    with _lock:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def get_history_id(user_key: str) -> Optional[str]:
+    """Último historyId sincronizado para o usuário"""
+    conn = get_connection()
+    with _lock:
+        row = conn.execute(
+            "SELECT history_id FROM sync_state WHERE user_key = ?", (user_key,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def set_history_id(user_key: str, history_id: str):
+    """Registra o historyId sincronizado para o usuário"""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(
+            "INSERT INTO sync_state (user_key, history_id) VALUES (?, ?) "
+            "ON CONFLICT(user_key) DO UPDATE SET history_id = excluded.history_id, "
+            "updated_at = CURRENT_TIMESTAMP",
+            (user_key, str(history_id))
+        )
+
+
+def normalize_analysis_field(value: Any) -> Optional[str]:
+    """Forma usada nas colunas indexadas: minúsculas e sem acento ("Média" -> "media")"""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    decomposed = unicodedata.normalize('NFKD', value.strip().lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def save_analyses(analyses: List[tuple]) -> int:
+    """Grava análises de IA: lista de (email_id, hash do conteúdo analisado, análise)"""
+    if not analyses:
+        return 0
+    now = time.time()
+    rows = [
+        (
+            email_id,
+            content_hash,
+            normalize_analysis_field(analysis.get('categoria')),
+            normalize_analysis_field(analysis.get('sentimento')),
+            normalize_analysis_field(analysis.get('urgencia')),
+            json.dumps(analysis, ensure_ascii=False),
+            now,
+        )
+        for email_id, content_hash, analysis in analyses
+    ]
+    conn = get_connection()
+    with _lock, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO email_analysis "
+            "(email_id, content_hash, categoria, sentimento, urgencia, data, analyzed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+    return len(rows)
+
+
+def get_analysis_hashes() -> Dict[str, str]:
+    """Hash do conteúdo de cada email já analisado (para achar os pendentes)"""
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute("SELECT email_id, content_hash FROM email_analysis").fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+def _analysis_filters(
+    category: Optional[str],
+    sentiment: Optional[str],
+    urgency: Optional[str]
+) -> tuple:
+    clauses, params = [], []
+    for column, value in (('categoria', category), ('sentimento', sentiment), ('urgencia', urgency)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(normalize_analysis_field(value))
+    return clauses, params
+
+
+def find_analyzed_ids(
+    category: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    urgency: Optional[str] = None
+) -> List[str]:
+    """Ids dos emails cuja análise bate com os filtros (só consulta os índices)"""
+    clauses, params = _analysis_filters(category, sentiment, urgency)
+    sql = "SELECT email_id FROM email_analysis"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    conn = get_connection()
+    with _lock:
+        return [row[0] for row in conn.execute(sql, params)]
+
+
+def get_analyses(email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Análises gravadas na ingestão para os emails indicados; retorna id -> análise"""
+    ids = list(dict.fromkeys(email_ids))
+    found = {}
+    conn = get_connection()
+    with _lock:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"SELECT email_id, data FROM email_analysis WHERE email_id IN ({placeholders})", chunk
+            ):
+                found[row[0]] = json.loads(row[1])
+    return found
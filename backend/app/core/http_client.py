@@ -0,0 +1,32 @@
+"""
+Cliente HTTP assíncrono compartilhado (pool de conexões do processo)
+"""
+from typing import Optional
+import httpx
+
+from app.core.config import settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retorna o httpx.AsyncClient compartilhado, criando-o na primeira chamada"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=settings.HTTP2_ENABLED,
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS
+            )
+        )
+    return _client
+
+
+async def close_http_client():
+    """Fecha o pool de conexões (usado no shutdown)"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
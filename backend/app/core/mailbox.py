@@ -0,0 +1,97 @@
+"""
+Visão em memória da caixa de emails, compartilhada pelo processo
+"""
+from typing import Dict, Any, List, Optional
+import asyncio
+import threading
+
+from app.core.database import load_emails, get_store_version
+
+
+class MailboxView:
+    """Snapshot imutável dos emails com índices por id e por thread"""
+
+    def __init__(self, emails: List[Dict[str, Any]], version: int):
+        self.version = version
+        self.emails = emails
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_thread: Dict[str, List[Dict[str, Any]]] = {}
+        for email in emails:
+            self.by_id[email.get('id')] = email
+            self.by_thread.setdefault(email.get('threadId'), []).append(email)
+
+    def get(self, email_id: str) -> Optional[Dict[str, Any]]:
+        """Busca um email pelo id em O(1)"""
+        return self.by_id.get(email_id)
+
+    def thread(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Emails de uma thread"""
+        return self.by_thread.get(thread_id, [])
+
+    def __len__(self) -> int:
+        return len(self.emails)
+
+
+_view: Optional[MailboxView] = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+# Reconstruções em andamento por versão (uma por vez para cada versão)
+_inflight: Dict[int, asyncio.Future] = {}
+
+
+def _rebuild(version: int) -> MailboxView:
+    global _view
+    with _lock:
+        # Outra requisição pode ter reconstruído enquanto esperávamos
+        if _view is not None and _view.version == version:
+            _stats["hits"] += 1
+            return _view
+        _stats["misses"] += 1
+        _view = MailboxView(load_emails(), version)
+        return _view
+
+
+def get_mailbox() -> MailboxView:
+    """Retorna a visão em cache, reconstruindo-a só quando o armazenamento muda"""
+    version = get_store_version()
+    view = _view
+    if view is not None and view.version == version:
+        _stats["hits"] += 1
+        return view
+    return _rebuild(version)
+
+
+async def aget_mailbox() -> MailboxView:
+    """
+    Versão de get_mailbox para handlers async: a reconstrução (load_emails
+    completo) roda numa thread, fora do event loop, e requisições
+    concorrentes para a mesma versão aguardam a mesma reconstrução.
+    """
+    version = get_store_version()
+    view = _view
+    if view is not None and view.version == version:
+        _stats["hits"] += 1
+        return view
+
+    task = _inflight.get(version)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_rebuild, version))
+        _inflight[version] = task
+        task.add_done_callback(lambda _: _inflight.pop(version, None))
+    else:
+        _stats["coalesced"] += 1
+    # Um cliente que desconecta não cancela a reconstrução dos demais
+    return await asyncio.shield(task)
+
+
+def get_mailbox_stats() -> Dict[str, Any]:
+    """Contadores de acerto/erro do cache"""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "coalesced": _stats["coalesced"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+        "version": _view.version if _view else None,
+        "size": len(_view) if _view else 0
+    }
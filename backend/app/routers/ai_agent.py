@@ -1,14 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends, Query, Header
 from fastapi.security import HTTPBearer
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import jwt
+import json
+import asyncio
 from app.core.config import settings
-from app.core.database import load_emails
-from app.services.ai_service import AIService
+from app.core.mailbox import aget_mailbox
+from app.core.database import find_analyzed_ids, get_analyses
+from app.services.ai_service import AIService, get_ai_service, build_analysis_content, RESPONSE_UNAVAILABLE
+from app.services.async_gmail_service import AsyncGmailService
+from app.services.rag_context import build_rag_context
+from app.services.response_cache import chat_response_cache, sources_key
+from app.services.vector_index import text_hash
 
 router = APIRouter()
 security = HTTPBearer()
+gmail_service = AsyncGmailService()
 
 class AIQuery(BaseModel):
     query: str
@@ -24,6 +33,7 @@ class EmailInsights(BaseModel):
     remetentes_frequentes: List[str]
     padroes_comunicacao: str
     sugestoes_organizacao: List[str]
+    estatisticas: Dict[str, Any] = {}
 
 def get_token(authorization: Optional[str] = Header(None)) -> str:
     if not authorization or not authorization.startswith("Bearer "):
@@ -39,33 +49,120 @@ def decode_token(token: str) -> dict:
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+async def hydrate_emails(token: str, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Garante o corpo dos emails, que a listagem traz só com metadados"""
+    if all(e.get('bodyLoaded', True) for e in emails):
+        return emails
+    credentials = gmail_service.get_credentials_from_token(decode_token(token))
+    return await gmail_service.hydrate_bodies(credentials, emails)
+
+def sse_event(event: str, data: Any) -> str:
+    """Formata um evento server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    """StreamingResponse para SSE, sem cache nem buffering de proxy"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def build_chat_context(
+    ai_service: AIService,
+    ai_query: AIQuery,
+    token: str,
+    query_vector: Optional[List[float]] = None
+):
+    """
+    Busca os emails relevantes; retorna (contexto para o modelo, fontes,
+    chave do conjunto de fontes para o cache de respostas)
+    """
+    relevant_emails = await ai_service.search_emails(
+        ai_query.query, k=settings.AI_CHAT_CANDIDATES, query_vector=query_vector
+    )
+    mailbox = await aget_mailbox()
+    full_emails = [mailbox.get(email['metadata']['id']) for email in relevant_emails]
+    
+    # Corpo dos mais bem ranqueados: o orçamento comporta no máximo um trecho
+    # por email para esta quantidade; os demais seguem com o snippet
+    limit = max(settings.AI_CHAT_CONTEXT_TOKENS // settings.AI_CHAT_PASSAGE_TOKENS, 1)
+    try:
+        hydrated = await hydrate_emails(token, [email for email in full_emails[:limit] if email])
+        by_id = {email['id']: email for email in hydrated}
+        full_emails = [by_id.get(email['id'], email) if email else None for email in full_emails]
+    except Exception as e:
+        print(f"Erro ao baixar corpos para o contexto do chat: {e}")
+    
+    # Sem histórico citado, assinaturas e trechos repetidos da mesma thread
+    reduced = iter(ai_service.reduce_emails([email for email in full_emails if email]))
+    candidates = [
+        {'text': next(reduced) if full_email else email['content'], 'metadata': email['metadata']}
+        for email, full_email in zip(relevant_emails, full_emails)
+    ]
+    
+    # Melhores trechos dentro do orçamento, em vez dos emails inteiros
+    rag = build_rag_context(
+        ai_query.query, candidates, settings.AI_CHAT_CONTEXT_TOKENS, settings.AI_CHAT_PASSAGE_TOKENS
+    )
+    cache_key = sources_key(
+        ((candidate['metadata'].get('id', ''), text_hash(candidate['text'])) for candidate in candidates),
+        ai_query.context or ""
+    )
+    return f"{ai_query.context}\n\nEmails relevantes:\n{rag['context']}", rag['sources'], cache_key
+
+async def stream_response_events(
+    ai_service: AIService,
+    email_content: str,
+    context: str,
+    sources: List[Dict[str, Any]],
+    on_complete=None
+):
+    """
+    Eventos SSE: fontes primeiro, depois os trechos da resposta e um evento final.
+    on_complete recebe o texto completo quando a geração termina sem erro.
+    """
+    yield sse_event("sources", {"sources": sources})
+    parts = []
+    try:
+        async for text in ai_service.astream_email_response(email_content, context):
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+    except Exception as e:
+        # O status HTTP já foi enviado; o erro vai como evento
+        print(f"Erro na geração de resposta em streaming: {e}")
+        yield sse_event("error", {"detail": f"Erro ao gerar resposta: {str(e)}"})
+        return
+    if on_complete is not None:
+        on_complete("".join(parts))
+    yield sse_event("done", {})
+
+async def cached_response_events(response: str, sources: List[Dict[str, Any]]):
+    """Mesmos eventos SSE do streaming, para uma resposta vinda do cache"""
+    yield sse_event("sources", {"sources": sources})
+    yield sse_event("token", {"text": response})
+    yield sse_event("done", {"cached": True})
+
 @router.post("/chat", response_model=AIResponse)
 async def chat_with_ai(
     ai_query: AIQuery,
-    token: str = Depends(get_token)
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
     """Chat com o agente de IA sobre emails"""
+    user_key = gmail_service.get_user_key(decode_token(token))
     try:
-        ai_service = AIService()
         # Buscar emails relevantes usando busca semântica
-        relevant_emails = ai_service.search_emails(ai_query.query, k=5)
-        
-        # Preparar contexto dos emails encontrados
-        context = ""
-        sources = []
+        query_vector = await ai_service.embed_query(ai_query.query)
+        full_context, sources, cache_key = await build_chat_context(ai_service, ai_query, token, query_vector)
         
-        for email in relevant_emails:
-            context += f"\n{email['content']}\n"
-            sources.append({
-                'subject': email['metadata'].get('subject', ''),
-                'sender': email['metadata'].get('sender', ''),
-                'date': email['metadata'].get('date', ''),
-                'content': email['content'][:200] + "..." if len(email['content']) > 200 else email['content']
-            })
-        
-        # Gerar resposta com IA
-        full_context = f"{ai_query.context}\n\nEmails relevantes:\n{context}"
-        response = ai_service.generate_email_response(ai_query.query, full_context)
+        # Pergunta equivalente com as mesmas fontes: responde do cache
+        response = chat_response_cache.get(user_key, cache_key, ai_query.query, query_vector)
+        if response is None:
+            # Gerar resposta com IA
+            response = await ai_service.agenerate_email_response(ai_query.query, full_context)
+            if response != RESPONSE_UNAVAILABLE:
+                chat_response_cache.put(user_key, cache_key, ai_query.query, query_vector, response)
         
         return AIResponse(
             response=response,
@@ -76,17 +173,40 @@ async def chat_with_ai(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no chat com IA: {str(e)}")
 
+@router.post("/chat/stream")
+async def chat_with_ai_stream(
+    ai_query: AIQuery,
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
+):
+    """Chat com o agente de IA em SSE: evento sources, eventos token e evento done"""
+    user_key = gmail_service.get_user_key(decode_token(token))
+    try:
+        query_vector = await ai_service.embed_query(ai_query.query)
+        full_context, sources, cache_key = await build_chat_context(ai_service, ai_query, token, query_vector)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro no chat com IA: {str(e)}")
+    
+    cached = chat_response_cache.get(user_key, cache_key, ai_query.query, query_vector)
+    if cached is not None:
+        return sse_response(cached_response_events(cached, sources))
+    
+    def remember(response: str):
+        chat_response_cache.put(user_key, cache_key, ai_query.query, query_vector, response)
+    
+    return sse_response(stream_response_events(ai_service, ai_query.query, full_context, sources, remember))
+
 @router.get("/insights", response_model=EmailInsights)
 async def get_email_insights(
     max_emails: int = Query(50, ge=10, le=200),
-    token: str = Depends(get_token)
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
     """Obtém insights gerais sobre os emails"""
     try:
-        ai_service = AIService()
-        emails = load_emails()
+        mailbox = await aget_mailbox()
         
-        if not emails:
+        if not mailbox.emails:
             return EmailInsights(
                 temas_principais=[],
                 remetentes_frequentes=[],
@@ -94,14 +214,15 @@ async def get_email_insights(
                 sugestoes_organizacao=[]
             )
         
-        # Gerar insights com IA
-        insights = ai_service.get_email_insights(emails)
+        # Gerar insights com IA (memoizados pela versão da caixa)
+        insights = await ai_service.get_mailbox_insights(mailbox)
         
         return EmailInsights(
             temas_principais=insights.get('temas_principais', []),
             remetentes_frequentes=insights.get('remetentes_frequentes', []),
             padroes_comunicacao=insights.get('padroes_comunicacao', ''),
-            sugestoes_organizacao=insights.get('sugestoes_organizacao', [])
+            sugestoes_organizacao=insights.get('sugestoes_organizacao', []),
+            estatisticas=insights.get('estatisticas', {})
         )
         
     except Exception as e:
@@ -110,48 +231,86 @@ async def get_email_insights(
 @router.post("/analyze-batch")
 async def analyze_emails_batch(
     email_ids: List[str],
-    token: str = Depends(get_token)
+    stream: bool = Query(False, description="Transmite o progresso em NDJSON"),
+    packed: bool = Query(False, description="Classifica vários emails por chamada ao modelo"),
+    concurrency: int = Query(settings.AI_BATCH_CONCURRENCY, ge=1, le=64),
+    timeout: float = Query(settings.AI_BATCH_ITEM_TIMEOUT, gt=0, le=300),
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
-    """Analisa múltiplos emails em lote"""
+    """Analisa múltiplos emails em lote, em paralelo"""
+    if len(email_ids) > settings.AI_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Lote maior que o limite de {settings.AI_BATCH_MAX_ITEMS} emails"
+        )
+    
     try:
-        ai_service = AIService()
-        emails = load_emails()
-        analyses = []
+        mailbox = await aget_mailbox()
         
-        for email_id in email_ids[:10]:  # Limitar a 10 emails por vez
-            try:
-                email_data = next((e for e in emails if e.get('id') == email_id), None)
-                if not email_data:
-                    print(f"Email {email_id} não encontrado.")
-                    continue
-                
-                # Preparar conteúdo para análise
-                content = f"""
-                Assunto: {email_data['subject']}
-                Remetente: {email_data['sender']}
-                Data: {email_data['date']}
-                Conteúdo: {email_data['body']}
-                """
-                
-                # Analisar com IA
-                analysis = ai_service.analyze_email_content(content)
-                analysis['email_id'] = email_id
-                analysis['subject'] = email_data['subject']
-                analysis['sender'] = email_data['sender']
-                
-                analyses.append(analysis)
-                
-            except Exception as e:
-                print(f"Erro ao analisar email {email_id}: {e}")
+        batch = []
+        not_found = []
+        for email_id in dict.fromkeys(email_ids):
+            email_data = mailbox.get(email_id)
+            if not email_data:
+                not_found.append(email_id)
                 continue
+            batch.append(email_data)
+        batch = await hydrate_emails(token, batch)
+        by_id = {e['id']: e for e in batch}
+        items = [(e['id'], build_analysis_content(e)) for e in batch]
         
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na análise em lote: {str(e)}")
+    
+    def to_analysis(result: Dict[str, Any]) -> Dict[str, Any]:
+        email_data = by_id[result['email_id']]
         return {
-            "total_analyzed": len(analyses),
-            "analyses": analyses
+            **result['analysis'],
+            'email_id': result['email_id'],
+            'subject': email_data['subject'],
+            'sender': email_data['sender']
         }
+    
+    analyze = ai_service.analyze_emails_packed if packed else ai_service.analyze_emails_batch
+    results = analyze(items, concurrency=concurrency, timeout=timeout)
+    
+    if stream:
+        async def generate():
+            done = 0
+            failed = 0
+            async for result in results:
+                done += 1
+                event = {"type": "progress", "done": done, "total": len(items)}
+                if result['status'] == 'ok':
+                    event["analysis"] = to_analysis(result)
+                else:
+                    failed += 1
+                    event["error"] = {"email_id": result['email_id'], "status": result['status'], "error": result['error']}
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            yield json.dumps({
+                "type": "summary",
+                "total_analyzed": done - failed,
+                "total_failed": failed,
+                "not_found": not_found
+            }, ensure_ascii=False) + "\n"
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro na análise em lote: {str(e)}")
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    
+    analyses = []
+    failed = []
+    async for result in results:
+        if result['status'] == 'ok':
+            analyses.append(to_analysis(result))
+        else:
+            failed.append({"email_id": result['email_id'], "status": result['status'], "error": result['error']})
+    
+    return {
+        "total_analyzed": len(analyses),
+        "analyses": analyses,
+        "failed": failed,
+        "not_found": not_found
+    }
 
 @router.get("/search/advanced")
 async def advanced_email_search(
@@ -160,36 +319,27 @@ async def advanced_email_search(
     sentiment: Optional[str] = Query(None, description="Sentimento (positivo, negativo, neutro)"),
     urgency: Optional[str] = Query(None, description="Urgência (alta, média, baixa)"),
     k: int = Query(10, ge=1, le=50),
-    token: str = Depends(get_token)
+    mode: str = Query("hybrid", pattern="^(hybrid|vector|keyword)$", description="Tipo de busca"),
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
-    """Busca avançada de emails com filtros"""
+    """Busca avançada de emails com filtros (sem chamadas ao modelo: usa as análises da ingestão)"""
     try:
-        ai_service = AIService()
-        # Busca semântica inicial
-        results = ai_service.search_emails(query, k=k*2)  # Buscar mais para filtrar depois
-        
-        # Aplicar filtros se especificados
-        filtered_results = []
+        # Filtros resolvidos pelo índice de análises antes da busca
+        within = None
+        if category or sentiment or urgency:
+            within = set(await asyncio.to_thread(
+                find_analyzed_ids, category=category, sentiment=sentiment, urgency=urgency
+            ))
         
-        for result in results:
-            # Analisar cada resultado para aplicar filtros
-            analysis = ai_service.analyze_email_content(result['content'])
-            
-            # Aplicar filtros
-            if category and analysis.get('categoria') != category:
-                continue
-            if sentiment and analysis.get('sentimento') != sentiment:
-                continue
-            if urgency and analysis.get('urgencia') != urgency:
-                continue
-            
-            filtered_results.append({
-                **result,
-                'analysis': analysis
-            })
-            
-            if len(filtered_results) >= k:
-                break
+        results = await ai_service.search_emails(query, k=k, mode=mode, within=within)
+        analyses = await asyncio.to_thread(
+            get_analyses, [result['metadata']['id'] for result in results]
+        )
+        filtered_results = [
+            {**result, 'analysis': analyses.get(result['metadata']['id'])}
+            for result in results
+        ]
         
         return {
             "query": query,
@@ -205,31 +355,37 @@ async def advanced_email_search(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na busca avançada: {str(e)}")
 
+def build_response_content(ai_service: AIService, email_data: Dict[str, Any]) -> str:
+    """Texto do email original enviado ao modelo para gerar a resposta (corpo reduzido)"""
+    body = ai_service.reduce_emails([email_data])[0]
+    return f"""
+        Assunto: {email_data['subject']}
+        Remetente: {email_data['sender']}
+        Data: {email_data['date']}
+        Conteúdo: {body}
+        """
+
+async def load_email_for_response(token: str, email_id: str) -> Dict[str, Any]:
+    """Email do armazenamento local, com o corpo baixado"""
+    email_data = (await aget_mailbox()).get(email_id)
+    
+    if not email_data:
+        raise HTTPException(status_code=404, detail=f"Email com ID {email_id} não encontrado.")
+    return (await hydrate_emails(token, [email_data]))[0]
+
 @router.post("/generate-response")
 async def generate_email_response(
     email_id: str,
     context: Optional[str] = "",
-    token: str = Depends(get_token)
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
     """Gera resposta para um email específico"""
     try:
-        ai_service = AIService()
-        emails = load_emails()
-        email_data = next((e for e in emails if e.get('id') == email_id), None)
-        
-        if not email_data:
-            raise HTTPException(status_code=404, detail=f"Email com ID {email_id} não encontrado.")
-        
-        # Preparar conteúdo do email
-        email_content = f"""
-        Assunto: {email_data['subject']}
-        Remetente: {email_data['sender']}
-        Data: {email_data['date']}
-        Conteúdo: {email_data['body']}
-        """
+        email_data = await load_email_for_response(token, email_id)
         
         # Gerar resposta
-        response = ai_service.generate_email_response(email_content, context)
+        response = await ai_service.agenerate_email_response(build_response_content(ai_service, email_data), context)
         
         return {
             "email_id": email_id,
@@ -241,23 +397,48 @@ async def generate_email_response(
             "generated_response": response
         }
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar resposta: {str(e)}")
+
+@router.post("/generate-response/stream")
+async def generate_email_response_stream(
+    email_id: str,
+    context: Optional[str] = "",
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
+):
+    """Gera resposta para um email em SSE; o evento sources traz o email original"""
+    try:
+        email_data = await load_email_for_response(token, email_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao gerar resposta: {str(e)}")
+    
+    sources = [{
+        'email_id': email_id,
+        'subject': email_data['subject'],
+        'sender': email_data['sender'],
+        'date': email_data['date']
+    }]
+    return sse_response(stream_response_events(ai_service, build_response_content(ai_service, email_data), context, sources))
 
 @router.get("/recommendations")
 async def get_email_recommendations(
-    token: str = Depends(get_token)
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
 ):
     """Obtém recomendações baseadas nos emails"""
     try:
-        ai_service = AIService()
-        emails = load_emails()
+        mailbox = await aget_mailbox()
         
-        if not emails:
+        if not mailbox.emails:
             return {"recommendations": []}
         
-        # Analisar emails para gerar recomendações
-        insights = ai_service.get_email_insights(emails)
+        # Reaproveita os insights da mesma versão da caixa
+        insights = await ai_service.get_mailbox_insights(mailbox)
         
         # Gerar recomendações baseadas nos insights
         recommendations = []
@@ -271,6 +452,24 @@ async def get_email_recommendations(
                 "action": "Considerar criar filtros ou labels para organizar melhor"
             })
         
+        # Recomendações baseadas nas estatísticas locais
+        stats = insights.get('estatisticas', {})
+        if stats.get('unread_ratio', 0) >= 0.3:
+            recommendations.append({
+                "type": "unread",
+                "title": "Emails Não Lidos",
+                "description": f"{stats['unread']} emails ({stats['unread_ratio']:.0%}) estão sem ler",
+                "action": "Marcar como lidos ou arquivar os emails antigos em lote"
+            })
+        top_domains = stats.get('top_domains', [])
+        if top_domains and top_domains[0]['count'] / stats['total'] >= 0.2:
+            recommendations.append({
+                "type": "frequent_domain",
+                "title": "Domínio Frequente",
+                "description": f"{top_domains[0]['count']} emails vêm de {top_domains[0]['value']}",
+                "action": f"Criar um filtro para o domínio {top_domains[0]['value']}"
+            })
+        
         # Recomendação baseada em temas
         if insights.get('temas_principais'):
             recommendations.append({
@@ -5,7 +5,7 @@ from typing import Dict, Any
 import jwt
 from datetime import datetime, timedelta
 from app.core.config import settings
-from app.services.gmail_service import GmailService
+from app.services.async_gmail_service import AsyncGmailService
 from fastapi import Request
 from fastapi.responses import HTMLResponse
 from fastapi import APIRouter, Request, HTTPException
@@ -35,7 +35,7 @@ class TokenResponse(BaseModel):
     token_type: str = "bearer"
     expires_in: int
 
-gmail_service = GmailService()
+gmail_service = AsyncGmailService()
 
 def create_access_token(data: Dict[str, Any]) -> str:
     """Cria JWT token"""
@@ -68,7 +68,7 @@ async def google_auth(token_request: TokenRequest):
         })
         
         # Testar credenciais buscando emails
-        emails = gmail_service.get_emails(credentials, max_results=1)
+        emails = await gmail_service.get_emails(credentials, max_results=1)
         
         if not emails:
             raise HTTPException(status_code=401, detail="Credenciais inválidas")
@@ -104,8 +104,7 @@ async def get_current_user(token_data: Dict[str, Any] = Depends(verify_token)):
         })
         
         # Buscar informações do perfil Gmail
-        service = gmail_service.build_service(credentials)
-        profile = service.users().getProfile(userId='me').execute()
+        profile = await gmail_service.get_profile(credentials)
         
         return {
             "email": profile.get('emailAddress'),
@@ -1,18 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, BackgroundTasks
 from fastapi.security import HTTPBearer
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from typing import List, Optional
 import jwt
 from datetime import datetime, timedelta
 import json
+import asyncio
 
-from app.services.gmail_service import GmailService
-from app.services.ai_service import AIService
+from app.services.async_gmail_service import AsyncGmailService
+from app.services.gmail_service import resolve_label_action
+from app.services.gmail_scheduler import GmailRateLimitError
+from app.services.ai_service import AIService, get_ai_service, ANALYSIS_ERROR
+from app.services.ingest import ingest_mailbox
 from app.core.config import settings
-from app.core.database import save_emails, load_emails
+from app.core.database import query_emails, get_email_by_id, modify_labels
 
 router = APIRouter()
 security = HTTPBearer()
 
+class BulkModifyRequest(BaseModel):
+    ids: List[str]
+    action: str = "modify"  # read, unread, archive ou modify
+    add_labels: List[str] = []
+    remove_labels: List[str] = []
+
 # Função para obter token do header
 def get_token(authorization: Optional[str] = Header(None)) -> str:
     if not authorization or not authorization.startswith("Bearer "):
@@ -30,7 +42,13 @@ def decode_token(token: str) -> dict:
         raise HTTPException(status_code=401, detail="Token inválido")
 
 @router.get("/")
-async def get_emails(token: str = Depends(get_token)):
+async def get_emails(
+    background_tasks: BackgroundTasks,
+    max_results: int = Query(50, ge=1, le=500),
+    full: bool = Query(False, description="Força uma sincronização completa"),
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
+):
     """Busca emails do Gmail"""
     try:
         # Decodificar token
@@ -40,18 +58,113 @@ async def get_emails(token: str = Depends(get_token)):
         if not access_token:
             raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
         
-        # Inicializar serviço Gmail
-        gmail_service = GmailService()
-        emails = await gmail_service.get_emails(access_token)
+        # Sincronizar o armazenamento local (incremental via historyId)
+        gmail_service = AsyncGmailService()
+        credentials = gmail_service.get_credentials_from_token(payload)
+        user_key = gmail_service.get_user_key(payload)
+        await gmail_service.sync_emails(credentials, user_key, max_results=max_results, full=full)
         
-        # Salvar emails localmente
-        save_emails(emails)
+        # Corpos, embeddings e análises depois da resposta, só para emails novos ou alterados
+        background_tasks.add_task(ingest_mailbox, ai_service, credentials)
         
-        return emails
+        return await asyncio.to_thread(query_emails, label='INBOX', limit=max_results)
         
+    except GmailRateLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Cota do Gmail excedida, tente novamente: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar emails: {str(e)}")
 
+@router.get("/stream")
+async def stream_emails(
+    q: Optional[str] = Query(None, description="Busca no formato do Gmail"),
+    label: Optional[str] = Query("INBOX", description="Label a percorrer"),
+    token: str = Depends(get_token)
+):
+    """Transmite todos os emails (NDJSON) seguindo a paginação do Gmail"""
+    payload = decode_token(token)
+    if not payload.get("access_token"):
+        raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
+    
+    gmail_service = AsyncGmailService()
+    credentials = gmail_service.get_credentials_from_token(payload)
+    
+    async def generate():
+        try:
+            async for email in gmail_service.iter_emails(
+                credentials, query=q, label_ids=[label] if label else None
+            ):
+                yield json.dumps(email, ensure_ascii=False) + "\n"
+        except Exception as e:
+            # O status HTTP já foi enviado; o erro vai como última linha
+            yield json.dumps({"error": f"Erro ao buscar emails: {str(e)}"}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+async def load_email(gmail_service: AsyncGmailService, credentials, email_id: str) -> Optional[dict]:
+    """Email do armazenamento local com o corpo baixado sob demanda (ou direto do Gmail)"""
+    email = await asyncio.to_thread(get_email_by_id, email_id)
+    if email:
+        return (await gmail_service.hydrate_bodies(credentials, [email]))[0]
+    return await gmail_service.get_email(credentials, email_id)
+
+@router.post("/bulk-modify")
+async def bulk_modify(request: BulkModifyRequest, token: str = Depends(get_token)):
+    """Altera labels de vários emails de uma vez (lido, não lido, arquivar, labels)"""
+    try:
+        add_labels, remove_labels = resolve_label_action(
+            request.action, request.add_labels, request.remove_labels
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        payload = decode_token(token)
+        access_token = payload.get("access_token")
+        
+        if not access_token:
+            raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
+        
+        gmail_service = AsyncGmailService()
+        credentials = gmail_service.get_credentials_from_token(payload)
+        ids = list(dict.fromkeys(request.ids))
+        modified = await gmail_service.batch_modify(credentials, ids, add_labels, remove_labels)
+        
+        # Atualiza o armazenamento local numa única transação
+        updated = await asyncio.to_thread(modify_labels, ids, add_labels, remove_labels)
+        
+        return {"modified": modified, "updated_locally": updated}
+        
+    except GmailRateLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Cota do Gmail excedida, tente novamente: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao alterar emails: {str(e)}")
+
+@router.get("/{email_id}")
+async def get_email(email_id: str, token: str = Depends(get_token)):
+    """Busca um email com o corpo (baixado na primeira leitura e guardado localmente)"""
+    try:
+        payload = decode_token(token)
+        access_token = payload.get("access_token")
+        
+        if not access_token:
+            raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
+        
+        gmail_service = AsyncGmailService()
+        credentials = gmail_service.get_credentials_from_token(payload)
+        email = await load_email(gmail_service, credentials, email_id)
+        
+        if not email:
+            raise HTTPException(status_code=404, detail="Email não encontrado")
+        
+        return email
+        
+    except HTTPException:
+        raise
+    except GmailRateLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Cota do Gmail excedida, tente novamente: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar email: {str(e)}")
+
 @router.post("/{email_id}/read")
 async def mark_as_read(email_id: str, token: str = Depends(get_token)):
     """Marca email como lido"""
@@ -62,16 +175,26 @@ async def mark_as_read(email_id: str, token: str = Depends(get_token)):
         if not access_token:
             raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
         
-        gmail_service = GmailService()
-        await gmail_service.mark_as_read(access_token, email_id)
+        gmail_service = AsyncGmailService()
+        credentials = gmail_service.get_credentials_from_token(payload)
+        if await gmail_service.mark_as_read(credentials, email_id):
+            await asyncio.to_thread(modify_labels, [email_id], remove_labels=['UNREAD'])
         
         return {"message": "Email marcado como lido"}
         
+    except HTTPException:
+        raise
+    except GmailRateLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Cota do Gmail excedida, tente novamente: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao marcar email como lido: {str(e)}")
 
 @router.get("/{email_id}/analysis")
-async def analyze_email(email_id: str, token: str = Depends(get_token)):
+async def analyze_email(
+    email_id: str,
+    token: str = Depends(get_token),
+    ai_service: AIService = Depends(get_ai_service)
+):
     """Analisa email com IA"""
     try:
         payload = decode_token(token)
@@ -80,21 +203,25 @@ async def analyze_email(email_id: str, token: str = Depends(get_token)):
         if not access_token:
             raise HTTPException(status_code=401, detail="Token de acesso não encontrado")
         
-        # Buscar email específico
-        gmail_service = GmailService()
-        email = await gmail_service.get_email(access_token, email_id)
+        # Buscar email específico (armazenamento local primeiro; corpo sob demanda)
+        gmail_service = AsyncGmailService()
+        credentials = gmail_service.get_credentials_from_token(payload)
+        email = await load_email(gmail_service, credentials, email_id)
         
         if not email:
             raise HTTPException(status_code=404, detail="Email não encontrado")
         
-        # Inicializar serviço de IA
-        ai_service = AIService()
-        
         # Analisar conteúdo do email
         content = f"Assunto: {email.get('subject', '')}\n\n{email.get('body', '')}"
-        analysis = ai_service.analyze_email_content(content)
-        
-        return analysis
-        
+        try:
+            return await ai_service.aanalyze_email_content(content)
+        except Exception as e:
+            print(f"Erro na análise de email: {e}")
+            return dict(ANALYSIS_ERROR)
+        
+    except HTTPException:
+        raise
+    except GmailRateLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Cota do Gmail excedida, tente novamente: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na análise: {str(e)}") 
\ No newline at end of file
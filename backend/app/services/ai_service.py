@@ -1,22 +1,142 @@
 import google.generativeai as genai
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.prompts import PromptTemplate
-from typing import List, Dict, Any
+from fastapi import Request
+from typing import List, Dict, Any, Optional, Set, Tuple, AsyncIterator
+import asyncio
+import hashlib
+import heapq
 import json
 from app.core.config import settings
+from app.core.mailbox import MailboxView, aget_mailbox
+from app.services.analysis_cache import analysis_cache, insights_cache
+from app.services.vector_index import vector_index, embedding_text, text_hash
+from app.services.keyword_index import keyword_index
+from app.services.single_flight import VersionedSingleFlight
+from app.services.text_reduction import reduce_text, reduce_thread
+from app.services.mailbox_stats import (
+    compute_mailbox_stats, email_timestamp, frequent_senders, describe_patterns, format_stats_summary
+)
+from app.services.token_budget import estimate_tokens, pack_by_budget
+
+# Versão do prompt de análise; mudar o template invalida o cache
+ANALYSIS_PROMPT_VERSION = "analysis-v1"
+
+# Versão do prompt empacotado (vários emails por chamada)
+PACKED_PROMPT_VERSION = "packed-analysis-v1"
+# Versões dos prompts do map-reduce de insights (fazem parte da chave do cache)
+INSIGHTS_CHUNK_PROMPT_VERSION = "insights-chunk-v2"
+INSIGHTS_MERGE_PROMPT_VERSION = "insights-merge-v2"
+INSIGHTS_REDUCE_PROMPT_VERSION = "insights-reduce-v2"
+
+# Tokens de saída estimados por análise, para limitar K pelo orçamento de saída
+ANALYSIS_OUTPUT_TOKENS = 150
+
+SENTIMENTOS = {"positivo", "negativo", "neutro"}
+URGENCIAS = {"alta", "media", "média", "baixa"}
+
+ANALYSIS_UNAVAILABLE = {
+    "resumo": "Análise não disponível",
+    "sentimento": "neutro",
+    "urgencia": "media",
+    "categoria": "outro",
+    "acoes_recomendadas": ["Revisar manualmente"]
+}
+
+ANALYSIS_ERROR = {
+    "resumo": "Erro na análise",
+    "sentimento": "neutro",
+    "urgencia": "media",
+    "categoria": "outro",
+    "acoes_recomendadas": ["Revisar manualmente"]
+}
+
+RESPONSE_UNAVAILABLE = "Desculpe, não foi possível gerar uma resposta no momento."
+
+
+# Campos de insights que dependem do modelo (os demais vêm de mailbox_stats)
+THEMES_UNAVAILABLE = {
+    "temas_principais": ["Análise não disponível"],
+    "sugestoes_organizacao": ["Revisar manualmente"]
+}
+
+THEMES_ERROR = {
+    "temas_principais": ["Erro na análise"],
+    "sugestoes_organizacao": ["Revisar manualmente"]
+}
+
+
+def insights_line(email: Dict[str, Any]) -> str:
+    """Linha que representa um email nos prompts de insights (só o assunto; contagens são locais)"""
+    return f"- {email.get('subject', 'N/A')}"
+
+
+def insights_digest(emails: List[Dict[str, Any]]) -> str:
+    """
+    Hash dos campos que os insights usam (id, thread, assunto, remetente, data
+    e labels). Corpo baixado sob demanda não muda o resultado.
+    """
+    digest = hashlib.sha1()
+    for email in emails:
+        fields = (
+            email.get('id', ''), email.get('threadId', ''), email.get('subject', ''),
+            email.get('sender', ''), email.get('date', ''), ','.join(sorted(email.get('labels', [])))
+        )
+        digest.update('\x1f'.join(fields).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def build_insights(stats: Dict[str, Any], themes: Dict[str, Any]) -> Dict[str, Any]:
+    """Junta os campos calculados localmente com os temas e sugestões do modelo"""
+    return {
+        "temas_principais": themes.get("temas_principais", []),
+        "remetentes_frequentes": frequent_senders(stats),
+        "padroes_comunicacao": describe_patterns(stats),
+        "sugestoes_organizacao": themes.get("sugestoes_organizacao", []),
+        "estatisticas": stats
+    }
+
+
+def is_valid_analysis(item: Dict[str, Any]) -> bool:
+    """Confere se um objeto segue o esquema resumo/sentimento/urgencia/categoria/acoes_recomendadas"""
+    return (
+        isinstance(item.get("resumo"), str)
+        and item.get("sentimento") in SENTIMENTOS
+        and item.get("urgencia") in URGENCIAS
+        and isinstance(item.get("categoria"), str) and bool(item.get("categoria"))
+        and isinstance(item.get("acoes_recomendadas"), list)
+    )
+
+def build_analysis_content(email_data: Dict[str, Any]) -> str:
+    """Texto enviado ao modelo para analisar um email (snippet se o corpo não foi baixado)"""
+    return f"""
+                Assunto: {email_data['subject']}
+                Remetente: {email_data['sender']}
+                Data: {email_data['date']}
+                Conteúdo: {email_data.get('body') or email_data.get('snippet', '')}
+                """
 
 class AIService:
+    """Serviço de IA; uma instância por processo, criada no lifespan da aplicação"""
+    
     def __init__(self):
         genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.model_name = "gemini-2.0-flash-exp"
         self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp",
+            model=self.model_name,
             temperature=0.7,
             google_api_key=settings.GEMINI_API_KEY
         )
-    
-    def analyze_email_content(self, email_content: str) -> Dict[str, Any]:
-        """Analisa o conteúdo de um email usando IA"""
-        prompt = PromptTemplate(
+        self.embedding_model = settings.EMBEDDING_MODEL
+        self.embeddings = GoogleGenerativeAIEmbeddings(
+            model=self.embedding_model,
+            google_api_key=settings.GEMINI_API_KEY
+        )
+        self.vector_index = vector_index
+        
+        # Templates montados uma única vez
+        self.analysis_prompt = PromptTemplate(
             input_variables=["email_content"],
             template="""
             Analise o seguinte email e forneça uma resposta em JSON com a seguinte estrutura:
@@ -35,37 +155,7 @@ class AIService:
             """
         )
         
-        try:
-            response = self.llm.invoke(prompt.format(email_content=email_content))
-            # Tenta extrair JSON da resposta
-            content = response.content
-            if isinstance(content, str):
-                # Remove possíveis prefixos/sufixos não-JSON
-                start = content.find('{')
-                end = content.rfind('}') + 1
-                if start != -1 and end != 0:
-                    json_str = content[start:end]
-                    return json.loads(json_str)
-            return {
-                "resumo": "Análise não disponível",
-                "sentimento": "neutro",
-                "urgencia": "media",
-                "categoria": "outro",
-                "acoes_recomendadas": ["Revisar manualmente"]
-            }
-        except Exception as e:
-            print(f"Erro na análise de email: {e}")
-            return {
-                "resumo": "Erro na análise",
-                "sentimento": "neutro",
-                "urgencia": "media",
-                "categoria": "outro",
-                "acoes_recomendadas": ["Revisar manualmente"]
-            }
-    
-    def generate_email_response(self, email_content: str, context: str = "") -> str:
-        """Gera uma resposta para um email usando IA"""
-        prompt = PromptTemplate(
+        self.response_prompt = PromptTemplate(
             input_variables=["email_content", "context"],
             template="""
             Com base no seguinte email, gere uma resposta profissional e apropriada em português.
@@ -80,29 +170,64 @@ class AIService:
             """
         )
         
-        try:
-            response = self.llm.invoke(prompt.format(email_content=email_content, context=context))
-            return response.content
-        except Exception as e:
-            print(f"Erro na geração de resposta: {e}")
-            return "Desculpe, não foi possível gerar uma resposta no momento."
-    
-    def get_email_insights(self, emails: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Gera insights sobre uma lista de emails"""
-        emails_text = "\n".join([f"De: {email.get('from', 'N/A')} - Assunto: {email.get('subject', 'N/A')} - Data: {email.get('date', 'N/A')}" for email in emails])
+        self.insights_prompt = PromptTemplate(
+            input_variables=["stats", "emails"],
+            template="""
+            Estatísticas da caixa de email (já calculadas):
+            {stats}
+
+            Assuntos dos emails:
+            {emails}
+
+            Identifique os temas principais e sugira formas de organizar a caixa.
+            Responda com JSON válido contendo:
+            {{
+                "temas_principais": ["tema1", "tema2"],
+                "sugestoes_organizacao": ["sugestão1", "sugestão2"]
+            }}
+
+            Responda APENAS com o JSON válido.
+            """
+        )
         
-        prompt = PromptTemplate(
+        # Map-reduce de insights: resumo por bloco, junção de resumos e JSON final
+        self.insights_chunk_prompt = PromptTemplate(
             input_variables=["emails"],
             template="""
-            Analise os seguintes emails e forneça insights em JSON:
+            Resuma os temas recorrentes do bloco de assuntos de email abaixo
+            em até 10 tópicos curtos.
 
             {emails}
 
+            Responda apenas com os tópicos, um por linha.
+            """
+        )
+        
+        self.insights_merge_prompt = PromptTemplate(
+            input_variables=["summaries"],
+            template="""
+            Combine os resumos parciais abaixo, de blocos consecutivos da mesma caixa de email,
+            em um único resumo de até 15 tópicos curtos, mantendo os temas mais relevantes.
+
+            {summaries}
+
+            Responda apenas com os tópicos, um por linha.
+            """
+        )
+        
+        self.insights_reduce_prompt = PromptTemplate(
+            input_variables=["stats", "summaries"],
+            template="""
+            Estatísticas da caixa de email (já calculadas):
+            {stats}
+
+            Resumos dos temas, cobrindo toda a caixa:
+            {summaries}
+
+            Identifique os temas principais e sugira formas de organizar a caixa.
             Responda com JSON válido contendo:
             {{
                 "temas_principais": ["tema1", "tema2"],
-                "remetentes_frequentes": ["remetente1", "remetente2"],
-                "padroes_comunicacao": "descrição dos padrões",
                 "sugestoes_organizacao": ["sugestão1", "sugestão2"]
             }}
 
@@ -110,41 +235,563 @@ class AIService:
             """
         )
         
+        self.packed_analysis_prompt = PromptTemplate(
+            input_variables=["emails"],
+            template="""
+            Analise cada um dos emails abaixo. Cada email começa com uma linha "### id: <id>".
+            Responda com um array JSON contendo um objeto por email, na forma:
+            [
+                {{
+                    "id": "<id do email>",
+                    "resumo": "resumo conciso do email",
+                    "sentimento": "positivo/negativo/neutro",
+                    "urgencia": "alta/media/baixa",
+                    "categoria": "trabalho/pessoal/spam/outro",
+                    "acoes_recomendadas": ["ação1", "ação2"]
+                }}
+            ]
+
+            Emails para análise:
+            {emails}
+
+            Responda APENAS com o array JSON válido, sem texto adicional.
+            """
+        )
+        self.packed_prompt_tokens = estimate_tokens(self.packed_analysis_prompt.template)
+        self._stats = {
+            "packed_calls": 0, "packed_items": 0, "packed_requeued": 0, "embedded": 0, "searches": 0,
+            "insights_llm_calls": 0, "insights_cached": 0,
+            "reduction_calls": 0, "reduction_tokens_before": 0, "reduction_tokens_saved": 0,
+            "reduction_last_tokens_saved": 0
+        }
+        # Insights da caixa inteira, memoizados pela versão do armazenamento
+        self._insights = VersionedSingleFlight()
+        # (versão da caixa, insights_digest) da última visão calculada
+        self._insights_key: Tuple[Optional[int], str] = (None, "")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores do serviço de IA"""
+        stats = dict(self._stats)
+        stats["items_per_packed_call"] = (
+            stats["packed_items"] / stats["packed_calls"] if stats["packed_calls"] else 0.0
+        )
+        stats["reduction_tokens_saved_per_call"] = (
+            stats["reduction_tokens_saved"] / stats["reduction_calls"] if stats["reduction_calls"] else 0.0
+        )
+        stats["indexed"] = len(self.vector_index)
+        stats["insights_memo"] = self._insights.get_stats()
+        return stats
+    
+    def _record_reduction(self, tokens_before: int, tokens_saved: int):
+        self._stats["reduction_calls"] += 1
+        self._stats["reduction_tokens_before"] += tokens_before
+        self._stats["reduction_tokens_saved"] += tokens_saved
+        self._stats["reduction_last_tokens_saved"] = tokens_saved
+    
+    def _reduce(self, text: str) -> str:
+        """Remove histórico citado, assinaturas e rodapés antes de enviar o texto ao modelo"""
+        result = reduce_text(text)
+        self._record_reduction(result.tokens_before, result.tokens_saved)
+        return result.text
+    
+    def reduce_emails(self, emails: List[Dict[str, Any]]) -> List[str]:
+        """
+        Corpos (ou snippets) reduzidos de vários emails, na ordem recebida,
+        sem o conteúdo repetido entre mensagens da mesma thread (a cópia mais
+        antiga de cada trecho é a que fica).
+        """
+        order = sorted(range(len(emails)), key=lambda i: email_timestamp(emails[i]))
+        bodies = [{**emails[i], 'body': emails[i].get('body') or emails[i].get('snippet', '')} for i in order]
+        results = reduce_thread(bodies)
+        self._record_reduction(
+            sum(result.tokens_before for result in results),
+            sum(result.tokens_saved for result in results)
+        )
+        texts = [''] * len(emails)
+        for index, result in zip(order, results):
+            texts[index] = result.text
+        return texts
+    
+    def _parse_analysis(self, content: Any) -> Optional[Dict[str, Any]]:
+        """Extrai o JSON da resposta do modelo (None se não houver JSON válido)"""
+        if isinstance(content, str):
+            # Remove possíveis prefixos/sufixos não-JSON
+            start = content.find('{')
+            end = content.rfind('}') + 1
+            if start != -1 and end != 0:
+                return json.loads(content[start:end])
+        return None
+    
+    def analyze_email_content(self, email_content: str) -> Dict[str, Any]:
+        """Analisa o conteúdo de um email usando IA (com cache pelo hash do conteúdo)"""
+        email_content = self._reduce(email_content)
+        cache_key = analysis_cache.make_key(email_content, self.model_name, ANALYSIS_PROMPT_VERSION)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            response = self.llm.invoke(prompt.format(emails=emails_text))
-            content = response.content
-            if isinstance(content, str):
-                start = content.find('{')
-                end = content.rfind('}') + 1
-                if start != -1 and end != 0:
-                    json_str = content[start:end]
-                    return json.loads(json_str)
-            return {
-                "temas_principais": ["Análise não disponível"],
-                "remetentes_frequentes": [],
-                "padroes_comunicacao": "Não foi possível analisar",
-                "sugestoes_organizacao": ["Revisar manualmente"]
-            }
+            response = self.llm.invoke(self.analysis_prompt.format(email_content=email_content))
+            analysis = self._parse_analysis(response.content)
+            if analysis is not None:
+                # Só respostas válidas vão para o cache
+                analysis_cache.put(cache_key, analysis)
+                return dict(analysis)
+            return dict(ANALYSIS_UNAVAILABLE)
+        except Exception as e:
+            print(f"Erro na análise de email: {e}")
+            return dict(ANALYSIS_ERROR)
+    
+    async def aanalyze_email_content(self, email_content: str) -> Dict[str, Any]:
+        """Versão assíncrona de analyze_email_content (usa ainvoke); erros são propagados"""
+        return await self._aanalyze_reduced(self._reduce(email_content))
+    
+    async def _aanalyze_reduced(self, email_content: str) -> Dict[str, Any]:
+        cache_key = analysis_cache.make_key(email_content, self.model_name, ANALYSIS_PROMPT_VERSION)
+        cached = await analysis_cache.aget(cache_key)
+        if cached is not None:
+            return cached
+        
+        response = await self.llm.ainvoke(self.analysis_prompt.format(email_content=email_content))
+        analysis = self._parse_analysis(response.content)
+        if analysis is None:
+            raise ValueError("Resposta do modelo sem JSON válido")
+        await analysis_cache.aput(cache_key, analysis)
+        return dict(analysis)
+    
+    async def analyze_emails_batch(
+        self,
+        items: List[Tuple[str, str]],
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Analisa (email_id, conteúdo) em paralelo, com limite de concorrência e
+        timeout por item. Produz cada resultado assim que fica pronto.
+        """
+        reduced = [(email_id, self._reduce(content)) for email_id, content in items]
+        async for result in self._analyze_reduced_batch(reduced, concurrency, timeout):
+            yield result
+    
+    async def _analyze_reduced_batch(
+        self,
+        items: List[Tuple[str, str]],
+        concurrency: Optional[int],
+        timeout: Optional[float]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(concurrency or settings.AI_BATCH_CONCURRENCY)
+        item_timeout = timeout or settings.AI_BATCH_ITEM_TIMEOUT
+        
+        async def run(email_id: str, content: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    analysis = await asyncio.wait_for(self._aanalyze_reduced(content), item_timeout)
+                    return {"email_id": email_id, "status": "ok", "analysis": analysis}
+                except asyncio.TimeoutError:
+                    return {"email_id": email_id, "status": "timeout", "error": f"Tempo esgotado ({item_timeout}s)"}
+                except Exception as e:
+                    return {"email_id": email_id, "status": "error", "error": str(e)}
+        
+        tasks = [asyncio.ensure_future(run(email_id, content)) for email_id, content in items]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Cliente desconectou ou o consumidor parou: cancela o que falta
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def _parse_packed_analyses(self, content: Any, expected_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Extrai do array JSON as análises válidas, indexadas pelo id do email"""
+        if not isinstance(content, str):
+            return {}
+        start = content.find('[')
+        end = content.rfind(']') + 1
+        if start == -1 or end == 0:
+            return {}
+        try:
+            items = json.loads(content[start:end])
+        except ValueError:
+            return {}
+        
+        expected = set(expected_ids)
+        valid = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            email_id = str(item.pop('id', ''))
+            if email_id in expected and is_valid_analysis(item):
+                valid[email_id] = item
+        return valid
+    
+    async def _cached_analyses(self, contents: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Análises em cache, tanto do modo individual quanto do empacotado, numa
+        única consulta fora do event loop (None para os conteúdos sem análise)
+        """
+        versions = (ANALYSIS_PROMPT_VERSION, PACKED_PROMPT_VERSION)
+        keys = [[analysis_cache.make_key(content, self.model_name, version) for version in versions] for content in contents]
+        found = await analysis_cache.aget_many(key for pair in keys for key in pair)
+        return [next((found[key] for key in pair if key in found), None) for pair in keys]
+    
+    async def aclassify_packed(self, items: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+        """Classifica vários emails numa única chamada; retorna só os itens válidos"""
+        emails_text = "\n\n".join(f"### id: {email_id}\n{content.strip()}" for email_id, content in items)
+        response = await self.llm.ainvoke(self.packed_analysis_prompt.format(emails=emails_text))
+        self._stats["packed_calls"] += 1
+        self._stats["packed_items"] += len(items)
+        
+        valid = self._parse_packed_analyses(response.content, [email_id for email_id, _ in items])
+        contents = dict(items)
+        await analysis_cache.aput_many([
+            (analysis_cache.make_key(contents[email_id], self.model_name, PACKED_PROMPT_VERSION), analysis)
+            for email_id, analysis in valid.items()
+        ])
+        return valid
+    
+    async def analyze_emails_packed(
+        self,
+        items: List[Tuple[str, str]],
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Como analyze_emails_batch, mas classificando K emails por chamada.
+
+        K se adapta ao orçamento de tokens de entrada e saída; itens que o
+        modelo não devolver de forma válida são reanalisados individualmente.
+        """
+        pending = []
+        reduced = [(email_id, self._reduce(content)) for email_id, content in items]
+        cached_analyses = await self._cached_analyses([content for _, content in reduced])
+        for (email_id, content), cached in zip(reduced, cached_analyses):
+            if cached is not None:
+                yield {"email_id": email_id, "status": "ok", "analysis": cached}
+            else:
+                pending.append((email_id, content))
+        if not pending:
+            return
+        
+        max_items = min(
+            settings.AI_PACKED_MAX_ITEMS,
+            max(1, settings.AI_PACKED_OUTPUT_TOKENS // ANALYSIS_OUTPUT_TOKENS)
+        )
+        budget = max(1, settings.AI_PACKED_INPUT_TOKENS - self.packed_prompt_tokens)
+        groups = pack_by_budget(pending, budget, max_items)
+        
+        semaphore = asyncio.Semaphore(concurrency or settings.AI_BATCH_CONCURRENCY)
+        item_timeout = timeout or settings.AI_BATCH_ITEM_TIMEOUT
+        
+        async def run(group: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict[str, Dict[str, Any]]]:
+            async with semaphore:
+                try:
+                    # A chamada empacotada gera mais saída: o timeout cresce com o lote
+                    valid = await asyncio.wait_for(self.aclassify_packed(group), item_timeout * len(group) ** 0.5)
+                except Exception as e:
+                    print(f"Erro na análise empacotada ({len(group)} emails): {e}")
+                    valid = {}
+                return group, valid
+        
+        tasks = [asyncio.ensure_future(run(group)) for group in groups]
+        requeue: List[Tuple[str, str]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                group, valid = await next_done
+                for email_id, content in group:
+                    if email_id in valid:
+                        yield {"email_id": email_id, "status": "ok", "analysis": dict(valid[email_id])}
+                    else:
+                        requeue.append((email_id, content))
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        # Itens inválidos ou ausentes voltam para a fila, um por chamada
+        self._stats["packed_requeued"] += len(requeue)
+        async for result in self._analyze_reduced_batch(requeue, concurrency, timeout):
+            yield result
+    
+    def generate_email_response(self, email_content: str, context: str = "") -> str:
+        """
+        Gera uma resposta para um email usando IA. O texto vai ao modelo como
+        recebido: quem chama reduz o conteúdo de emails (reduce_emails), nunca
+        a pergunta do usuário.
+        """
+        try:
+            response = self.llm.invoke(self.response_prompt.format(email_content=email_content, context=context))
+            return response.content
+        except Exception as e:
+            print(f"Erro na geração de resposta: {e}")
+            return RESPONSE_UNAVAILABLE
+    
+    async def agenerate_email_response(self, email_content: str, context: str = "") -> str:
+        """Versão assíncrona de generate_email_response (usa ainvoke)"""
+        try:
+            response = await self.llm.ainvoke(self.response_prompt.format(email_content=email_content, context=context))
+            return response.content
+        except Exception as e:
+            print(f"Erro na geração de resposta: {e}")
+            return RESPONSE_UNAVAILABLE
+    
+    async def astream_email_response(self, email_content: str, context: str = "") -> AsyncIterator[str]:
+        """Versão em streaming de generate_email_response: produz os trechos à medida que o modelo os gera"""
+        prompt = self.response_prompt.format(email_content=email_content, context=context)
+        async for chunk in self.llm.astream(prompt):
+            if chunk.content:
+                yield chunk.content
+    
+    def get_email_insights(self, emails: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Gera insights sobre uma lista de emails: remetentes e padrões vêm das
+        estatísticas locais; o modelo só recebe o resumo delas e os assuntos.
+        """
+        stats = compute_mailbox_stats(emails)
+        emails_text = "\n".join(insights_line(email) for email in emails)
+        
+        try:
+            response = self.llm.invoke(
+                self.insights_prompt.format(stats=format_stats_summary(stats), emails=emails_text)
+            )
+            themes = self._parse_analysis(response.content) or dict(THEMES_UNAVAILABLE)
         except Exception as e:
             print(f"Erro na geração de insights: {e}")
-            return {
-                "temas_principais": ["Erro na análise"],
-                "remetentes_frequentes": [],
-                "padroes_comunicacao": "Erro na análise",
-                "sugestoes_organizacao": ["Revisar manualmente"]
-            }
+            themes = dict(THEMES_ERROR)
+        return build_insights(stats, themes)
     
-    def search_emails_semantic(self, query: str, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Busca semântica em emails (versão simplificada)"""
-        # Por enquanto, retorna todos os emails que contêm a query no assunto ou conteúdo
-        results = []
-        query_lower = query.lower()
+    async def index_emails(self, emails: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Sincroniza o índice vetorial com a caixa: gera embeddings só dos emails
+        novos ou alterados e remove os que não existem mais.
+        """
+        index = self.vector_index
+        await asyncio.to_thread(index.load)
+        if index.model != self.embedding_model:
+            index.reset(self.embedding_model)
         
+        pending = []
+        current = set()
         for email in emails:
-            subject = email.get('subject', '').lower()
-            content = email.get('content', '').lower()
-            
-            if query_lower in subject or query_lower in content:
-                results.append(email)
+            current.add(email['id'])
+            text = embedding_text(email)
+            digest = text_hash(text)
+            if index.hash_of(email['id']) != digest:
+                pending.append((email['id'], digest, text))
+        stale = [email_id for email_id in index.ids() if email_id not in current]
+        index.remove(stale)
+        
+        embedded = 0
+        try:
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                vectors = await self.embeddings.aembed_documents([text for _, _, text in chunk])
+                index.upsert([(email_id, digest, vector) for (email_id, digest, _), vector in zip(chunk, vectors)])
+                embedded += len(chunk)
+        finally:
+            # Mantém o que já foi gerado mesmo se um lote falhar
+            self._stats["embedded"] += embedded
+            await asyncio.to_thread(index.save)
+        
+        return {"embedded": embedded, "removed": len(stale), "total": len(index)}
+    
+    async def _cached_insights_call(self, prompt: str, prompt_version: str, text: str) -> Optional[str]:
+        """Chamada do map-reduce com cache pelo hash do texto de entrada (None se falhar)"""
+        key = insights_cache.make_key(text, self.model_name, prompt_version)
+        cached = await insights_cache.aget(key)
+        if cached is not None:
+            self._stats["insights_cached"] += 1
+            return cached["text"]
+        try:
+            response = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            print(f"Erro no resumo de insights ({prompt_version}): {e}")
+            return None
+        self._stats["insights_llm_calls"] += 1
+        if not isinstance(response.content, str) or not response.content.strip():
+            return None
+        await insights_cache.aput(key, {"text": response.content})
+        return response.content
+    
+    async def _merge_summaries(self, summaries: List[str], semaphore: asyncio.Semaphore) -> List[str]:
+        """Junta resumos em grupos de AI_INSIGHTS_MERGE_FANOUT até caberem numa única chamada final"""
+        fanout = max(2, settings.AI_INSIGHTS_MERGE_FANOUT)
+        while len(summaries) > fanout:
+            async def merge(group: List[str]) -> Optional[str]:
+                text = "\n\n---\n\n".join(group)
+                async with semaphore:
+                    return await self._cached_insights_call(
+                        self.insights_merge_prompt.format(summaries=text), INSIGHTS_MERGE_PROMPT_VERSION, text
+                    )
+            groups = [summaries[i:i + fanout] for i in range(0, len(summaries), fanout)]
+            merged = await asyncio.gather(*(merge(group) for group in groups))
+            summaries = [summary for summary in merged if summary]
+        return summaries
+    
+    async def aget_email_insights(self, emails: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Insights em map-reduce: os emails, em ordem cronológica, são divididos
+        em blocos de AI_INSIGHTS_CHUNK_SIZE; cada bloco é resumido (com cache
+        pelo hash do bloco) e os resumos são combinados no JSON final.
+        Remetentes e padrões vêm de mailbox_stats; o modelo só extrai temas.
+        Caixas pequenas usam uma única chamada, como get_email_insights.
+        """
+        chunk_size = max(1, settings.AI_INSIGHTS_CHUNK_SIZE)
+        if len(emails) <= chunk_size:
+            return await asyncio.to_thread(self.get_email_insights, emails)
+        
+        stats = await asyncio.to_thread(compute_mailbox_stats, emails)
+        # Ordem cronológica: emails novos só alteram os últimos blocos
+        ordered = sorted(emails, key=email_timestamp)
+        chunks = [
+            "\n".join(insights_line(email) for email in ordered[i:i + chunk_size])
+            for i in range(0, len(ordered), chunk_size)
+        ]
+        semaphore = asyncio.Semaphore(settings.AI_BATCH_CONCURRENCY)
+        
+        async def summarize(text: str) -> Optional[str]:
+            async with semaphore:
+                return await self._cached_insights_call(
+                    self.insights_chunk_prompt.format(emails=text), INSIGHTS_CHUNK_PROMPT_VERSION, text
+                )
         
-        return results[:10]  # Limita a 10 resultados 
\ No newline at end of file
+        summaries = [summary for summary in await asyncio.gather(*(summarize(c) for c in chunks)) if summary]
+        summaries = await self._merge_summaries(summaries, semaphore)
+        if not summaries:
+            return build_insights(stats, THEMES_UNAVAILABLE)
+        
+        stats_text = format_stats_summary(stats)
+        text = "\n\n---\n\n".join(summaries)
+        result = await self._cached_insights_call(
+            self.insights_reduce_prompt.format(stats=stats_text, summaries=text),
+            INSIGHTS_REDUCE_PROMPT_VERSION,
+            f"{stats_text}\n\n{text}"
+        )
+        try:
+            themes = self._parse_analysis(result)
+        except ValueError:
+            themes = None
+        return build_insights(stats, themes or THEMES_UNAVAILABLE)
+    
+    async def get_mailbox_insights(self, mailbox: MailboxView) -> Dict[str, Any]:
+        """
+        Insights da caixa, recalculados só quando os campos que eles usam
+        mudam (não a cada corpo baixado); pedidos simultâneos compartilham a
+        mesma computação.
+        """
+        version, key = self._insights_key
+        if version != mailbox.version:
+            key = await asyncio.to_thread(insights_digest, mailbox.emails)
+            self._insights_key = (mailbox.version, key)
+        return await self._insights.get(
+            key,
+            lambda: self.aget_email_insights(mailbox.emails),
+            # Falhas do modelo não ficam presas no cache até a próxima sincronização
+            cacheable=lambda insights: insights["temas_principais"] not in (
+                THEMES_UNAVAILABLE["temas_principais"], THEMES_ERROR["temas_principais"]
+            )
+        )
+    
+    def _search_result(self, email: Dict[str, Any], score: float) -> Dict[str, Any]:
+        """Formato {content, metadata} esperado pelos routers"""
+        return {
+            'content': embedding_text(email),
+            'metadata': {
+                'id': email.get('id', ''),
+                'threadId': email.get('threadId', ''),
+                'subject': email.get('subject', ''),
+                'sender': email.get('sender', ''),
+                'date': email.get('date', ''),
+                'score': score
+            }
+        }
+    
+    async def embed_query(self, query: str) -> Optional[List[float]]:
+        """Embedding da consulta, ou None se o índice vetorial estiver vazio ou indisponível"""
+        await asyncio.to_thread(self.vector_index.load)
+        if not len(self.vector_index):
+            return None
+        try:
+            return await self.embeddings.aembed_query(query)
+        except Exception as e:
+            print(f"Erro ao gerar embedding da consulta: {e}")
+            return None
+    
+    async def search_emails(
+        self,
+        query: str,
+        k: int = 5,
+        mode: str = "hybrid",
+        within: Optional[Set[str]] = None,
+        query_vector: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Busca emails; retorna [{content, metadata}].
+        
+        mode: "vector" (similaridade de embeddings), "keyword" (BM25) ou
+        "hybrid" (funde as duas pontuações). Sem embeddings disponíveis,
+        "hybrid" recai em BM25 puro. within restringe a busca a um conjunto de ids;
+        query_vector reaproveita um embedding da consulta já calculado.
+        """
+        self._stats["searches"] += 1
+        if within is not None and not within:
+            return []
+        mailbox = await aget_mailbox()
+        if mode == "keyword":
+            query_vector = None
+        elif query_vector is None:
+            query_vector = await self.embed_query(query)
+        
+        if mode == "vector":
+            hits = self.vector_index.search(query_vector, k, within) if query_vector is not None else []
+        else:
+            keywords = await asyncio.to_thread(lambda: keyword_index.refresh(mailbox).scores(query))
+            if within is not None:
+                keywords = {email_id: score for email_id, score in keywords.items() if email_id in within}
+            if query_vector is None:
+                hits = heapq.nlargest(k, keywords.items(), key=lambda item: item[1])
+            else:
+                hits = self._fuse_scores(query_vector, keywords, k, within)
+        
+        results = []
+        for email_id, score in hits:
+            email = mailbox.get(email_id)
+            if email is not None:
+                results.append(self._search_result(email, score))
+        return results
+    
+    def _fuse_scores(
+        self,
+        query_vector: List[float],
+        keywords: Dict[str, float],
+        k: int,
+        within: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Fusão híbrida: candidatos = top do BM25 + top vetorial; cada pontuação
+        é normalizada para [0, 1] e combinada com peso HYBRID_VECTOR_WEIGHT.
+        """
+        pool = k * settings.HYBRID_CANDIDATES_FACTOR
+        top_keywords = heapq.nlargest(pool, keywords.items(), key=lambda item: item[1])
+        candidates = {email_id for email_id, _ in top_keywords}
+        candidates.update(email_id for email_id, _ in self.vector_index.search(query_vector, pool, within))
+        vectors = self.vector_index.scores_for(query_vector, list(candidates))
+        
+        max_keyword = top_keywords[0][1] if top_keywords else 0.0
+        low, high = (min(vectors.values()), max(vectors.values())) if vectors else (0.0, 0.0)
+        weight = settings.HYBRID_VECTOR_WEIGHT
+        fused = []
+        for email_id in candidates:
+            keyword_score = keywords.get(email_id, 0.0) / max_keyword if max_keyword else 0.0
+            vector_score = (vectors.get(email_id, low) - low) / (high - low) if high > low else 0.0
+            fused.append((email_id, weight * vector_score + (1 - weight) * keyword_score))
+        return heapq.nlargest(k, fused, key=lambda item: item[1])
+
+
+def get_ai_service(request: Request) -> AIService:
+    """Dependência FastAPI: retorna o AIService compartilhado criado no lifespan"""
+    ai_service = getattr(request.app.state, "ai_service", None)
+    if ai_service is None:
+        ai_service = request.app.state.ai_service = AIService()
+    return ai_service
@@ -0,0 +1,193 @@
+"""
+Cache persistente de análises de IA, indexado pelo hash do conteúdo
+"""
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+
+from app.core.config import settings
+from app.core.database import transaction
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# Chaves por consulta SQL em get_many (abaixo do limite de parâmetros do SQLite)
+SQL_CHUNK_SIZE = 500
+
+
+def normalize_content(content: str) -> str:
+    """Normaliza espaços para que a mesma mensagem gere sempre a mesma chave"""
+    return _WHITESPACE_RE.sub(' ', content or '').strip()
+
+
+class AnalysisCache:
+    """LRU em memória na frente de uma tabela SQLite com TTL e limite de tamanho"""
+
+    def __init__(self, namespace: str, max_entries: int, ttl_seconds: float, memory_entries: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._stats = {"hits": 0, "memory_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def make_key(self, content: str, model: str, prompt_version: str) -> str:
+        """Chave = hash do conteúdo normalizado + modelo + versão do prompt"""
+        digest = hashlib.sha256()
+        for part in (normalize_content(content), model, prompt_version):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def _remember(self, key: str, value: Dict[str, Any], created_at: float):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and now - cached[1] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return dict(cached[0])
+        return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Retorna uma cópia do valor em cache, ou None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Valores em cache das chaves (as ausentes ou expiradas são omitidas), numa única transação"""
+        now = time.time()
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self._from_memory(key, now)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+        if not missing:
+            return found
+
+        rows = {}
+        with transaction() as conn:
+            for start in range(0, len(missing), SQL_CHUNK_SIZE):
+                chunk = missing[start:start + SQL_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(
+                    f"SELECT key, value, created_at FROM analysis_cache WHERE namespace = ? AND key IN ({placeholders})",
+                    (self.namespace, *chunk)
+                ):
+                    rows[row['key']] = row
+            fresh = [key for key, row in rows.items() if now - row['created_at'] < self.ttl_seconds]
+            expired = [key for key in rows if key not in fresh]
+            conn.executemany(
+                "UPDATE analysis_cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                [(now, self.namespace, key) for key in fresh]
+            )
+            conn.executemany(
+                "DELETE FROM analysis_cache WHERE namespace = ? AND key = ?",
+                [(self.namespace, key) for key in expired]
+            )
+
+        for key in fresh:
+            value = json.loads(rows[key]['value'])
+            self._remember(key, value, rows[key]['created_at'])
+            found[key] = dict(value)
+        self._stats["hits"] += len(fresh)
+        self._stats["misses"] += len(missing) - len(fresh)
+        return found
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Guarda o valor na memória e no SQLite"""
+        self.put_many([(key, value)])
+
+    def put_many(self, items: List[Tuple[str, Dict[str, Any]]]):
+        """Guarda vários valores numa única transação"""
+        if not items:
+            return
+        now = time.time()
+        for key, value in items:
+            self._remember(key, dict(value), now)
+        with transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO analysis_cache (namespace, key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(self.namespace, key, json.dumps(value, ensure_ascii=False), now, now) for key, value in items]
+            )
+        self._stats["writes"] += len(items)
+        self._puts_since_evict += len(items)
+        # A limpeza roda de tempos em tempos, não a cada escrita
+        if self._puts_since_evict >= 100:
+            self._puts_since_evict = 0
+            self.evict()
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get para código assíncrono: acerto em memória direto, SQLite numa thread"""
+        value = self._from_memory(key, time.time())
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    async def aget_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """get_many numa thread, fora do event loop"""
+        return await asyncio.to_thread(self.get_many, list(keys))
+
+    async def aput(self, key: str, value: Dict[str, Any]):
+        """put numa thread, fora do event loop"""
+        await asyncio.to_thread(self.put, key, value)
+
+    async def aput_many(self, items: List[Tuple[str, Dict[str, Any]]]):
+        """put_many numa thread, fora do event loop"""
+        if items:
+            await asyncio.to_thread(self.put_many, items)
+
+    def evict(self):
+        """Remove entradas expiradas e as menos usadas além do limite"""
+        with transaction() as conn:
+            expired = conn.execute(
+                "DELETE FROM analysis_cache WHERE namespace = ? AND created_at < ?",
+                (self.namespace, time.time() - self.ttl_seconds)
+            ).rowcount
+            overflow = conn.execute(
+                "DELETE FROM analysis_cache WHERE namespace = ? AND key IN ("
+                "  SELECT key FROM analysis_cache WHERE namespace = ?"
+                "  ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries)
+            ).rowcount
+        self._stats["evictions"] += expired + overflow
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores e taxa de acerto"""
+        total = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": self._stats["hits"] / total if total else 0.0,
+            "memory_size": len(self._memory)
+        }
+
+
+analysis_cache = AnalysisCache(
+    namespace="analysis",
+    max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    memory_entries=settings.ANALYSIS_CACHE_MEMORY_ENTRIES
+)
+
+# Resumos parciais do map-reduce de insights, pelo hash do bloco de emails
+insights_cache = AnalysisCache(
+    namespace="insights_chunk",
+    max_entries=settings.INSIGHTS_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    memory_entries=settings.INSIGHTS_CACHE_MAX_ENTRIES
+)
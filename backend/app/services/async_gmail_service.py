@@ -0,0 +1,396 @@
+from google.oauth2.credentials import Credentials
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+import asyncio
+import json
+import os
+import weakref
+import httpx
+
+from app.core.config import settings
+from app.core.http_client import get_http_client
+from app.core.database import (
+    save_emails, delete_emails, update_labels, get_history_id, set_history_id
+)
+from app.services.gmail_service import (
+    GmailService, HISTORY_TYPES, METADATA_HEADERS, BATCH_MODIFY_LIMIT, GMAIL_BATCH_LIMIT
+)
+from app.services.gmail_batch import GMAIL_BATCH_URL, build_batch_request, parse_batch_response
+from app.services.gmail_scheduler import gmail_scheduler, is_retryable_status, GmailRateLimitError
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+
+
+class GmailAPIError(Exception):
+    """Erro retornado pela API REST do Gmail"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    retry_after = response.headers.get('Retry-After')
+    return float(retry_after) if retry_after and retry_after.isdigit() else None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Erro de cota/servidor ou falha de transporte: vale repetir"""
+    if isinstance(error, GmailAPIError):
+        return is_retryable_status(error.status, error.message)
+    return isinstance(error, httpx.TransportError)
+
+
+def _api_method(http_method: str, path: str) -> str:
+    """Nome do método da API (para o custo de cota) a partir do caminho REST"""
+    parts = path.split('/')
+    if parts[0] == 'profile':
+        return 'getProfile'
+    if parts[0] == 'history':
+        return 'history.list'
+    if parts[0] == 'threads':
+        return 'threads.get'
+    if path == 'messages/batchModify':
+        return 'messages.batchModify'
+    if len(parts) == 1:
+        return 'messages.list'
+    if parts[-1] == 'modify':
+        return 'messages.modify'
+    return 'messages.get'
+
+
+# Semáforos por usuário; somem sozinhos quando nenhuma requisição os usa
+_user_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def _get_user_semaphore(user_key: str) -> asyncio.Semaphore:
+    semaphore = _user_semaphores.get(user_key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.GMAIL_MAX_INFLIGHT_PER_USER)
+        _user_semaphores[user_key] = semaphore
+    return semaphore
+
+
+class AsyncGmailService(GmailService):
+    """Cliente da Gmail API assíncrono sobre o httpx.AsyncClient compartilhado"""
+
+    async def _refresh_access_token(self, credentials: Credentials) -> bool:
+        """Renova o access token usando o refresh token"""
+        if not credentials.refresh_token:
+            return False
+        response = await get_http_client().post(TOKEN_URL, data={
+            "grant_type": "refresh_token",
+            "refresh_token": credentials.refresh_token,
+            "client_id": credentials.client_id or os.getenv("GOOGLE_CLIENT_ID"),
+            "client_secret": credentials.client_secret or os.getenv("GOOGLE_CLIENT_SECRET")
+        })
+        if response.status_code != 200:
+            return False
+        credentials.token = response.json().get('access_token')
+        return bool(credentials.token)
+
+    async def _request(self, credentials: Credentials, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """Executa uma chamada à API pelo agendador de cota, com retry e backoff"""
+        user_key = self._credentials_key(credentials)
+        return await gmail_scheduler.run(
+            user_key,
+            _api_method(method, path),
+            lambda: self._send(credentials, user_key, method, path, **kwargs),
+            is_retryable_error
+        )
+
+    async def _http(
+        self,
+        credentials: Credentials,
+        user_key: str,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """Envia a requisição limitando as chamadas simultâneas por usuário"""
+        semaphore = _get_user_semaphore(user_key)
+        client = get_http_client()
+
+        async with semaphore:
+            for attempt in range(2):
+                response = await client.request(
+                    method,
+                    url,
+                    headers={**(headers or {}), "Authorization": f"Bearer {credentials.token}"},
+                    **kwargs
+                )
+                # Token expirado: renova uma vez e repete
+                if response.status_code == 401 and attempt == 0:
+                    if await self._refresh_access_token(credentials):
+                        continue
+                break
+        return response
+
+    async def _send(self, credentials: Credentials, user_key: str, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """Envia uma chamada REST e devolve o JSON (GmailAPIError para status de erro)"""
+        response = await self._http(credentials, user_key, method, f"{GMAIL_API_URL}/{path}", **kwargs)
+        if response.status_code >= 400:
+            raise GmailAPIError(response.status_code, response.text, _retry_after(response))
+        return response.json() if response.content else {}
+
+    async def _send_batch(
+        self,
+        credentials: Credentials,
+        user_key: str,
+        message_ids: List[str],
+        params: Dict[str, Any],
+        fetched: Dict[str, Dict[str, Any]]
+    ) -> Tuple[List[str], Optional[float]]:
+        """
+        Envia um batch HTTP de messages.get; retorna os ids cujas subrequisições
+        devem ser repetidas e o maior Retry-After entre as falhas (None se nenhum)
+        """
+        # Cada subrequisição consome cota como uma chamada avulsa
+        await gmail_scheduler.acquire(user_key, 'messages.get', len(message_ids))
+        content_type, body = build_batch_request(
+            [(message_id, f"messages/{message_id}", params) for message_id in message_ids]
+        )
+        try:
+            response = await self._http(
+                credentials, user_key, "POST", GMAIL_BATCH_URL,
+                headers={"Content-Type": content_type}, content=body
+            )
+        except httpx.TransportError as error:
+            print(f'Erro no batch de mensagens: {error}')
+            gmail_scheduler.record_batch(user_key, 'messages.get', 0, len(message_ids))
+            return list(message_ids), None
+
+        if response.status_code >= 400:
+            if not is_retryable_status(response.status_code, response.text):
+                raise GmailAPIError(response.status_code, response.text)
+            print(f'Erro no batch de mensagens: {response.status_code}')
+            gmail_scheduler.record_batch(user_key, 'messages.get', 0, len(message_ids))
+            return list(message_ids), _retry_after(response)
+
+        parts = parse_batch_response(response.headers.get('content-type', ''), response.content)
+        failed = []
+        retry_after = None
+        for message_id in message_ids:
+            part = parts.get(message_id)
+            if part is None or is_retryable_status(part.status, part.body):
+                failed.append(message_id)
+                if part is not None and part.retry_after is not None:
+                    retry_after = max(retry_after or 0.0, part.retry_after)
+            elif part.status >= 400:
+                print(f'Erro ao buscar mensagem {message_id}: {part.status} {part.body[:200]}')
+            else:
+                fetched[message_id] = json.loads(part.body)
+        gmail_scheduler.record_batch(user_key, 'messages.get', len(message_ids) - len(failed), len(failed))
+        return failed, retry_after
+
+    async def _fetch_messages(self, credentials: Credentials, message_ids: List[str], format: str = 'full') -> Dict[str, Dict[str, Any]]:
+        """Busca mensagens via batch HTTP, reenviando apenas as subrequisições que falharem"""
+        params: Dict[str, Any] = {"format": format}
+        if format == 'metadata':
+            params["metadataHeaders"] = METADATA_HEADERS
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, GMAIL_BATCH_LIMIT))
+        user_key = self._credentials_key(credentials)
+        fetched: Dict[str, Dict[str, Any]] = {}
+        pending = list(dict.fromkeys(message_ids))
+        retry_after = None
+
+        for attempt in range(settings.GMAIL_BATCH_MAX_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                # Backoff exponencial com jitter antes de reenviar as falhas,
+                # nunca antes do maior Retry-After pedido por elas
+                await asyncio.sleep(gmail_scheduler.backoff_delay(attempt, retry_after))
+            results = await asyncio.gather(*(
+                self._send_batch(credentials, user_key, pending[start:start + batch_size], params, fetched)
+                for start in range(0, len(pending), batch_size)
+            ))
+            pending = [message_id for failed, _ in results for message_id in failed]
+            waits = [wait for _, wait in results if wait is not None]
+            retry_after = max(waits) if waits else None
+
+        if pending:
+            # Melhor falhar a sincronização (o historyId não avança) do que perder mensagens
+            raise GmailRateLimitError(
+                f'{len(pending)} mensagens não puderam ser buscadas após '
+                f'{settings.GMAIL_BATCH_MAX_RETRIES} tentativas'
+            )
+        return fetched
+
+    async def get_emails(self, credentials: Credentials, max_results: int = 50) -> List[Dict[str, Any]]:
+        """Busca emails da caixa de entrada"""
+        try:
+            results = await self._request(
+                credentials, "GET", "messages",
+                params={"labelIds": "INBOX", "maxResults": max_results}
+            )
+            message_ids = [m['id'] for m in results.get('messages', [])]
+            fetched = await self._fetch_messages(credentials, message_ids, format='metadata')
+            return [
+                self._parse_email_message(fetched[m], include_body=False)
+                for m in message_ids if m in fetched
+            ]
+
+        except (GmailAPIError, httpx.HTTPError) as error:
+            print(f'Erro ao buscar emails: {error}')
+            return []
+
+    async def iter_emails(
+        self,
+        credentials: Credentials,
+        query: Optional[str] = None,
+        label_ids: Optional[List[str]] = None,
+        page_size: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Percorre toda a caixa (ou o resultado de uma busca) seguindo nextPageToken"""
+        params: Dict[str, Any] = {"maxResults": page_size or settings.GMAIL_PAGE_SIZE}
+        if query:
+            params["q"] = query
+        if label_ids:
+            params["labelIds"] = label_ids
+
+        next_page = asyncio.ensure_future(self._request(credentials, "GET", "messages", params=params))
+        try:
+            while next_page is not None:
+                results = await next_page
+                page_token = results.get('nextPageToken')
+                # Lista a próxima página enquanto as mensagens desta são buscadas
+                next_page = asyncio.ensure_future(self._request(
+                    credentials, "GET", "messages", params={**params, "pageToken": page_token}
+                )) if page_token else None
+
+                message_ids = [m['id'] for m in results.get('messages', [])]
+                fetched = await self._fetch_messages(credentials, message_ids, format='metadata')
+                for message_id in message_ids:
+                    if message_id in fetched:
+                        yield self._parse_email_message(fetched[message_id], include_body=False)
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def get_email(self, credentials: Credentials, message_id: str) -> Optional[Dict[str, Any]]:
+        """Busca um único email"""
+        try:
+            message = await self._request(credentials, "GET", f"messages/{message_id}", params={"format": "full"})
+            return self._parse_email_message(message)
+        except GmailAPIError as error:
+            if error.status == 404:
+                return None
+            raise
+
+    async def hydrate_bodies(self, credentials: Credentials, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Baixa sob demanda o corpo dos emails listados só com metadados e o guarda no armazenamento"""
+        missing = [e['id'] for e in emails if not e.get('bodyLoaded', True)]
+        if not missing:
+            return emails
+
+        fetched = await self._fetch_messages(credentials, missing, format='full')
+        hydrated = {m: self._parse_email_message(message) for m, message in fetched.items()}
+        if hydrated:
+            await asyncio.to_thread(save_emails, list(hydrated.values()))
+        return [hydrated.get(e['id'], e) for e in emails]
+
+    async def get_profile(self, credentials: Credentials) -> Dict[str, Any]:
+        """Busca o perfil Gmail do usuário"""
+        return await self._request(credentials, "GET", "profile")
+
+    async def mark_as_read(self, credentials: Credentials, message_id: str) -> bool:
+        """Marca email como lido"""
+        try:
+            await self._request(
+                credentials, "POST", f"messages/{message_id}/modify",
+                json={'removeLabelIds': ['UNREAD']}
+            )
+            return True
+        except (GmailAPIError, httpx.HTTPError) as error:
+            print(f'Erro ao marcar como lido: {error}')
+            return False
+
+    async def batch_modify(
+        self,
+        credentials: Credentials,
+        message_ids: List[str],
+        add_label_ids: Optional[List[str]] = None,
+        remove_label_ids: Optional[List[str]] = None
+    ) -> int:
+        """Altera labels de vários emails com messages.batchModify (até 1000 ids por chamada)"""
+        modified = 0
+        for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+            chunk = message_ids[start:start + BATCH_MODIFY_LIMIT]
+            await self._request(credentials, "POST", "messages/batchModify", json={
+                'ids': chunk,
+                'addLabelIds': add_label_ids or [],
+                'removeLabelIds': remove_label_ids or []
+            })
+            modified += len(chunk)
+        return modified
+
+    async def get_email_thread(self, credentials: Credentials, thread_id: str) -> List[Dict[str, Any]]:
+        """Busca thread completa de emails"""
+        try:
+            thread = await self._request(credentials, "GET", f"threads/{thread_id}")
+            return [self._parse_email_message(message) for message in thread['messages']]
+        except (GmailAPIError, httpx.HTTPError) as error:
+            print(f'Erro ao buscar thread: {error}')
+            return []
+
+    async def sync_emails(self, credentials: Credentials, user_key: str, max_results: int = 50, full: bool = False) -> Dict[str, Any]:
+        """Sincroniza o armazenamento local; incremental via historyId sempre que possível"""
+        history_id = None if full else await asyncio.to_thread(get_history_id, user_key)
+
+        if history_id:
+            try:
+                return await self._sync_incremental(credentials, user_key, history_id)
+            except GmailAPIError as error:
+                if error.status != 404:
+                    raise
+                print(f'historyId {history_id} expirado, refazendo sincronização completa')
+
+        return await self._sync_full(credentials, user_key, max_results)
+
+    async def _sync_full(self, credentials: Credentials, user_key: str, max_results: int) -> Dict[str, Any]:
+        """Baixa as mensagens mais recentes da caixa de entrada e registra o historyId"""
+        profile = await self.get_profile(credentials)
+        results = await self._request(
+            credentials, "GET", "messages",
+            params={"labelIds": "INBOX", "maxResults": max_results}
+        )
+        message_ids = [m['id'] for m in results.get('messages', [])]
+        fetched = await self._fetch_messages(credentials, message_ids, format='metadata')
+
+        emails = [self._parse_email_message(fetched[m], include_body=False) for m in message_ids if m in fetched]
+        changed = await asyncio.to_thread(save_emails, emails)
+        await asyncio.to_thread(set_history_id, user_key, profile['historyId'])
+
+        return {'mode': 'full', 'fetched': len(fetched), 'changed': changed, 'deleted': 0}
+
+    async def _sync_incremental(self, credentials: Credentials, user_key: str, history_id: str) -> Dict[str, Any]:
+        """Aplica ao armazenamento local apenas as mudanças desde o último historyId"""
+        records = []
+        page_token = None
+        latest_history_id = history_id
+
+        while True:
+            params = {"startHistoryId": history_id, "historyTypes": HISTORY_TYPES}
+            if page_token:
+                params["pageToken"] = page_token
+            response = await self._request(credentials, "GET", "history", params=params)
+            records.extend(response.get('history', []))
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        to_fetch, to_delete, label_map = await asyncio.to_thread(self._collect_history_changes, records)
+
+        fetched = await self._fetch_messages(credentials, to_fetch, format='metadata') if to_fetch else {}
+        emails = [self._parse_email_message(m, include_body=False) for m in fetched.values()]
+        changed = await asyncio.to_thread(save_emails, emails)
+        changed += await asyncio.to_thread(update_labels, label_map)
+        deleted = await asyncio.to_thread(delete_emails, to_delete)
+        await asyncio.to_thread(set_history_id, user_key, latest_history_id)
+
+        return {'mode': 'incremental', 'fetched': len(fetched), 'changed': changed, 'deleted': deleted}
@@ -0,0 +1,84 @@
+"""
+Montagem e leitura de requisições batch HTTP (multipart/mixed) da Gmail API
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+import re
+import uuid
+
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+# Caminho das subrequisições, relativo ao host da API
+GMAIL_API_PATH = "/gmail/v1/users/me"
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_BLANK_LINE_RE = re.compile(r'\r?\n\r?\n')
+_STATUS_RE = re.compile(r'^HTTP/\S+\s+(\d{3})')
+
+
+class BatchPart(NamedTuple):
+    status: int
+    body: str
+    retry_after: Optional[float]
+
+
+def build_batch_request(requests: List[Tuple[str, str, Dict]]) -> Tuple[str, bytes]:
+    """
+    Corpo multipart/mixed para [(id da subrequisição, caminho, parâmetros)].
+
+    Retorna (Content-Type, corpo). Os ids voltam no Content-ID das respostas.
+    """
+    boundary = f"batch_{uuid.uuid4().hex}"
+    lines = []
+    for request_id, path, params in requests:
+        query = f"?{urlencode(params, doseq=True)}" if params else ""
+        lines += [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            f"Content-ID: <{request_id}>",
+            "",
+            f"GET {GMAIL_API_PATH}/{path}{query}",
+            "",
+        ]
+    lines.append(f"--{boundary}--")
+    return f"multipart/mixed; boundary={boundary}", "\r\n".join(lines).encode('utf-8')
+
+
+def _headers(block: str) -> Dict[str, str]:
+    headers = {}
+    for line in block.splitlines():
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_batch_response(content_type: str, content: bytes) -> Dict[str, BatchPart]:
+    """Respostas de um batch por id da subrequisição (sem o prefixo "response-")"""
+    match = _BOUNDARY_RE.search(content_type or '')
+    if not match:
+        raise ValueError(f"Resposta batch sem boundary: {content_type}")
+    delimiter = f"--{match.group(1)}"
+
+    parts: Dict[str, BatchPart] = {}
+    for chunk in content.decode('utf-8', errors='replace').split(delimiter):
+        chunk = chunk.strip()
+        if not chunk or chunk == '--':
+            continue
+        # Cabeçalhos da parte, depois a resposta HTTP embutida (status, cabeçalhos, corpo)
+        sections = _BLANK_LINE_RE.split(chunk, maxsplit=2)
+        if len(sections) < 2:
+            continue
+        request_id = _headers(sections[0]).get('content-id', '').strip('<>')
+        if request_id.startswith('response-'):
+            request_id = request_id[len('response-'):]
+        status_line, _, response_headers = sections[1].partition('\n')
+        status = _STATUS_RE.match(status_line.strip())
+        if not request_id or not status:
+            continue
+        retry_after = _headers(response_headers).get('retry-after')
+        parts[request_id] = BatchPart(
+            int(status.group(1)),
+            sections[2] if len(sections) > 2 else '',
+            float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+    return parts
@@ -0,0 +1,195 @@
+"""
+Agendador de requisições à Gmail API com controle de cota por usuário
+"""
+from typing import Callable, Awaitable, Dict, Any, Optional, TypeVar
+from collections import deque
+import asyncio
+import random
+import threading
+import time
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+# Custo em unidades de cota de cada método (tabela oficial da Gmail API)
+QUOTA_UNITS = {
+    'getProfile': 1,
+    'history.list': 2,
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'threads.get': 10,
+}
+DEFAULT_UNITS = 5
+# Status que justificam repetir a chamada (403 só quando o motivo é limite de taxa)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Janela usada para medir a vazão atual
+THROUGHPUT_WINDOW = 60.0
+
+
+class GmailRateLimitError(Exception):
+    """Tentativas esgotadas para uma chamada limitada por cota ou com erro do servidor"""
+
+
+def is_retryable_status(status: int, content: str = "") -> bool:
+    """Indica se uma resposta de erro da Gmail API deve ser repetida"""
+    if status == 403:
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return status in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """Token bucket com taxa adaptativa: cai ao receber erros de limite e se recupera aos poucos"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.penalized_at = 0.0
+
+    def reserve(self, units: float) -> float:
+        """Reserva as unidades e retorna quantos segundos esperar antes de usá-las"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= units
+        return max(0.0, -self.tokens / self.rate)
+
+    def penalize(self):
+        # Uma rajada de falhas simultâneas conta como um único sinal
+        now = time.monotonic()
+        if now - self.penalized_at >= 1.0:
+            self.penalized_at = now
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.7)
+
+    def reward(self):
+        self.rate = min(self.max_rate, self.rate * 1.02)
+
+
+class GmailRequestScheduler:
+    """Ritma as chamadas de cada usuário abaixo da cota e repete as que falham por limite"""
+
+    def __init__(
+        self,
+        units_per_second: float,
+        burst: float,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float
+    ):
+        self.units_per_second = units_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._window: deque = deque()
+        self._stats = {"calls": 0, "units": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    def _reserve(self, user_key: str, method: str, count: int = 1) -> float:
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS) * count
+        with self._lock:
+            bucket = self._buckets.get(user_key)
+            if bucket is None:
+                bucket = self._buckets[user_key] = TokenBucket(self.units_per_second, self.burst)
+            wait = bucket.reserve(units)
+            if wait:
+                self._stats["throttled"] += 1
+        return wait
+
+    def _record(self, user_key: str, method: str, count: int, ok: bool):
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS) * count
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_key)
+            if bucket is not None and ok:
+                bucket.reward()
+            elif bucket is not None:
+                bucket.penalize()
+            if not ok:
+                return
+            self._stats["calls"] += count
+            self._stats["units"] += units
+            self._window.append((now, count, units))
+            while self._window and self._window[0][0] < now - THROUGHPUT_WINDOW:
+                self._window.popleft()
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Backoff exponencial com jitter (respeitando Retry-After quando enviado)"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        return max(delay, retry_after or 0.0)
+
+    def _on_failure(self, user_key: str, method: str, attempt: int, error: Exception) -> float:
+        self._record(user_key, method, 1, ok=False)
+        if attempt >= self.max_retries:
+            self._stats["failures"] += 1
+            raise GmailRateLimitError(
+                f"{method}: tentativas esgotadas após {attempt + 1} chamadas ({error})"
+            ) from error
+        self._stats["retries"] += 1
+        return self.backoff_delay(attempt, getattr(error, 'retry_after', None))
+
+    async def run(
+        self,
+        user_key: str,
+        method: str,
+        call: Callable[[], Awaitable[T]],
+        is_retryable: Callable[[Exception], bool]
+    ) -> T:
+        """Executa a chamada assíncrona respeitando a cota do usuário"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(user_key, method)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                result = await call()
+            except Exception as error:
+                if not is_retryable(error):
+                    raise
+                await asyncio.sleep(self._on_failure(user_key, method, attempt, error))
+                continue
+            self._record(user_key, method, 1, ok=True)
+            return result
+
+    async def acquire(self, user_key: str, method: str, count: int = 1):
+        """Reserva a cota de várias subrequisições (batch HTTP) e espera se preciso"""
+        wait = self._reserve(user_key, method, count)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record_batch(self, user_key: str, method: str, succeeded: int, failed: int):
+        """Registra o resultado de um batch HTTP"""
+        if succeeded:
+            self._record(user_key, method, succeeded, ok=True)
+        if failed:
+            self._record(user_key, method, failed, ok=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores e vazão atual (última janela de 60 s)"""
+        now = time.monotonic()
+        with self._lock:
+            window = [entry for entry in self._window if entry[0] >= now - THROUGHPUT_WINDOW]
+            rates = {key: round(bucket.rate, 1) for key, bucket in self._buckets.items()}
+        elapsed = min(THROUGHPUT_WINDOW, now - window[0][0]) if window else 0.0
+        return {
+            **self._stats,
+            "calls_per_second": sum(e[1] for e in window) / elapsed if elapsed else 0.0,
+            "units_per_second": sum(e[2] for e in window) / elapsed if elapsed else 0.0,
+            "quota_units_per_second": self.units_per_second,
+            "user_rates": rates,
+        }
+
+
+gmail_scheduler = GmailRequestScheduler(
+    units_per_second=settings.GMAIL_QUOTA_UNITS_PER_SECOND,
+    burst=settings.GMAIL_QUOTA_BURST,
+    max_retries=settings.GMAIL_MAX_RETRIES,
+    backoff_base=settings.GMAIL_BACKOFF_BASE,
+    backoff_max=settings.GMAIL_BACKOFF_MAX
+)
@@ -1,17 +1,51 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import base64
 import email
+import hashlib
 from typing import List, Dict, Any, Optional
 import json
 import os
 from datetime import datetime, timedelta
-import httpx
+
+from app.core.http_client import get_http_client
+from app.services.mime_parser import build_header_map, extract_body, walk_payload
+from app.core.database import get_emails_by_ids
+
+# Limite de subrequisições por batch HTTP imposto pela API do Gmail
+GMAIL_BATCH_LIMIT = 100
+# Tipos de evento acompanhados na sincronização incremental
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Cabeçalhos pedidos nas listagens (format='metadata'); o corpo vem sob demanda
+METADATA_HEADERS = ['Subject', 'From', 'Date']
+# Limite de ids por chamada de messages.batchModify
+BATCH_MODIFY_LIMIT = 1000
+# Ações de bulk-modify: (labels adicionadas, labels removidas)
+LABEL_ACTIONS = {
+    'read': ([], ['UNREAD']),
+    'unread': (['UNREAD'], []),
+    'archive': ([], ['INBOX']),
+    'modify': ([], []),
+}
+
+
+def resolve_label_action(action: str, add_labels: Optional[List[str]] = None, remove_labels: Optional[List[str]] = None):
+    """Converte uma ação de bulk-modify nas listas de labels a adicionar/remover"""
+    if action not in LABEL_ACTIONS:
+        raise ValueError(f"Ação inválida: {action}")
+    add, remove = LABEL_ACTIONS[action]
+    add, remove = list(add) + list(add_labels or []), list(remove) + list(remove_labels or [])
+    if not add and not remove:
+        # batchModify sem labels gasta cota e não altera nada
+        raise ValueError("Nenhuma label para adicionar ou remover")
+    return add, remove
+
 
 class GmailService:
+    """
+    Base do cliente Gmail: OAuth, credenciais, parsing de mensagens e
+    redução do histórico. As chamadas à API ficam no AsyncGmailService.
+    """
     
     def __init__(self):
         self.SCOPES = [
@@ -40,9 +74,8 @@ class GmailService:
             "grant_type": "authorization_code"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(token_url, data=data)
-            return response.json()
+        response = await get_http_client().post(token_url, data=data)
+        return response.json()
         
     def get_credentials_from_token(self, token_info: Dict[str, Any]) -> Credentials:
         """Cria credenciais a partir do token"""
@@ -55,52 +88,70 @@ class GmailService:
             scopes=self.SCOPES
         )
     
-    def build_service(self, credentials: Credentials):
-        """Constrói serviço Gmail"""
-        return build('gmail', 'v1', credentials=credentials)
+    def get_user_key(self, token_info: Dict[str, Any]) -> str:
+        """Identificador estável do usuário, usado para guardar o estado de sincronização"""
+        identity = (
+            token_info.get('refresh_token')
+            or token_info.get('access_token')
+            or token_info.get('sub', 'user')
+        )
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+    
+    def _credentials_key(self, credentials: Credentials) -> str:
+        return self.get_user_key({
+            'refresh_token': credentials.refresh_token,
+            'access_token': credentials.token
+        })
     
-    def get_emails(self, credentials: Credentials, max_results: int = 50) -> List[Dict[str, Any]]:
-        """Busca emails da caixa de entrada"""
-        try:
-            service = self.build_service(credentials)
-            
-            # Buscar emails
-            results = service.users().messages().list(
-                userId='me',
-                labelIds=['INBOX'],
-                maxResults=max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
-            emails = []
-            
-            for message in messages:
-                msg = service.users().messages().get(
-                    userId='me',
-                    id=message['id'],
-                    format='full'
-                ).execute()
-                
-                email_data = self._parse_email_message(msg)
-                emails.append(email_data)
-            
-            return emails
-            
-        except HttpError as error:
-            print(f'Erro ao buscar emails: {error}')
-            return []
+    def _collect_history_changes(self, records: List[Dict[str, Any]]):
+        """Reduz os registros de histórico a (ids para buscar, ids para remover, novas labels)"""
+        added: Dict[str, List[str]] = {}
+        deleted = set()
+        labels: Dict[str, List[str]] = {}
         
-    def _parse_email_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
-        """Parseia mensagem do Gmail"""
-        headers = message['payload']['headers']
+        # Os registros vêm em ordem crescente; o estado mais recente prevalece
+        for record in records:
+            for item in record.get('messagesAdded', []):
+                message = item['message']
+                added[message['id']] = message.get('labelIds', [])
+                deleted.discard(message['id'])
+            for item in record.get('messagesDeleted', []):
+                deleted.add(item['message']['id'])
+            for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                message = item['message']
+                labels[message['id']] = message.get('labelIds', [])
+        
+        for message_id in deleted:
+            added.pop(message_id, None)
+            labels.pop(message_id, None)
+        
+        stored = get_emails_by_ids(list(set(added) | set(labels)))
+        to_fetch = []
+        label_map = {}
+        for message_id in set(added) | set(labels):
+            current = labels.get(message_id, added.get(message_id, []))
+            if message_id in stored:
+                label_map[message_id] = current
+            elif 'INBOX' in current:
+                to_fetch.append(message_id)
+        
+        return to_fetch, list(deleted), label_map
+    
+    def _parse_email_message(self, message: Dict[str, Any], include_body: bool = True) -> Dict[str, Any]:
+        """Parseia mensagem do Gmail (com include_body=False para respostas format='metadata')"""
+        headers = build_header_map(message['payload'].get('headers', []))
         
         # Extrair informações básicas
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'Sem assunto')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Desconhecido')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
+        subject = headers.get('subject', 'Sem assunto')
+        sender = headers.get('from', 'Desconhecido')
+        date = headers.get('date', '')
         
-        # Extrair corpo do email
-        body = self._extract_email_body(message['payload'])
+        # Extrair corpo do email (e detectar anexos na mesma passada)
+        if include_body:
+            body, has_attachments = walk_payload(message['payload'])
+        else:
+            # format='metadata' não traz as partes; multipart/mixed é o indício de anexo
+            body, has_attachments = None, message['payload'].get('mimeType', '').lower() == 'multipart/mixed'
         
         # Processar labels
         labels = message.get('labelIds', [])
@@ -112,60 +163,14 @@ class GmailService:
             'sender': sender,
             'date': date,
             'body': body,
+            'bodyLoaded': include_body,
             'labels': labels,
             'snippet': message.get('snippet', ''),
             'isRead': 'UNREAD' not in labels,
             'isImportant': 'IMPORTANT' in labels,
-            'hasAttachments': 'ATTACHMENT' in labels
+            'hasAttachments': has_attachments
         }
     
     def _extract_email_body(self, payload: Dict[str, Any]) -> str:
-        """Extrai corpo do email"""
-        if 'body' in payload and payload['body'].get('data'):
-            return base64.urlsafe_b64decode(
-                payload['body']['data'].encode('ASCII')
-            ).decode('utf-8')
-        
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
-                        return base64.urlsafe_b64decode(
-                            part['body']['data'].encode('ASCII')
-                        ).decode('utf-8')
-        
-        return ""
-    
-    def mark_as_read(self, credentials: Credentials, message_id: str) -> bool:
-        """Marca email como lido"""
-        try:
-            service = self.build_service(credentials)
-            service.users().messages().modify(
-                userId='me',
-                id=message_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            return True
-        except HttpError as error:
-            print(f'Erro ao marcar como lido: {error}')
-            return False
-    
-    def get_email_thread(self, credentials: Credentials, thread_id: str) -> List[Dict[str, Any]]:
-        """Busca thread completa de emails"""
-        try:
-            service = self.build_service(credentials)
-            thread = service.users().threads().get(
-                userId='me',
-                id=thread_id
-            ).execute()
-            
-            emails = []
-            for message in thread['messages']:
-                email_data = self._parse_email_message(message)
-                emails.append(email_data)
-            
-            return emails
-            
-        except HttpError as error:
-            print(f'Erro ao buscar thread: {error}')
-            return []
\ No newline at end of file
+        """Extrai corpo do email (percorre partes aninhadas; HTML vira texto)"""
+        return extract_body(payload)
@@ -0,0 +1,120 @@
+"""
+Ingestão: processamento feito uma única vez por email depois da sincronização
+"""
+from google.oauth2.credentials import Credentials
+from typing import Dict, Any, List, Optional
+import asyncio
+
+from app.core.config import settings
+from app.core.database import get_analysis_hashes, save_analyses
+from app.core.mailbox import aget_mailbox
+from app.services.ai_service import AIService, build_analysis_content
+from app.services.async_gmail_service import AsyncGmailService
+from app.services.keyword_index import keyword_index
+from app.services.vector_index import text_hash
+
+gmail_service = AsyncGmailService()
+
+_lock = asyncio.Lock()
+_pending = False
+# Credenciais da chamada mais recente, usadas pela próxima rodada
+_credentials: Optional[Credentials] = None
+
+# Análises gravadas no banco a cada N resultados
+ANALYSIS_SAVE_EVERY = 100
+
+
+async def analyze_new_emails(ai_service: AIService, emails: List[Dict[str, Any]]) -> int:
+    """
+    Analisa os emails ainda sem análise (ou cujo conteúdo mudou) e grava o
+    resultado na tabela email_analysis. Processa no máximo AI_INGEST_MAX_ITEMS
+    por rodada, dos mais recentes para os mais antigos.
+
+    Só entram emails com o corpo baixado: a análise do snippet seria refeita
+    quando o corpo chegasse (o hash do conteúdo muda) e divergiria da de
+    /ai/analyze-batch, que sempre analisa o corpo.
+    """
+    stored = await asyncio.to_thread(get_analysis_hashes)
+    pending = []
+    hashes = {}
+    for email in emails:
+        if not email.get('bodyLoaded', True):
+            continue
+        content = build_analysis_content(email)
+        digest = text_hash(content)
+        if stored.get(email['id']) != digest:
+            pending.append((email['id'], content))
+            hashes[email['id']] = digest
+            if len(pending) >= settings.AI_INGEST_MAX_ITEMS:
+                break
+    if not pending:
+        return 0
+
+    saved = 0
+    batch = []
+    async for result in ai_service.analyze_emails_packed(pending):
+        if result['status'] != 'ok':
+            continue
+        batch.append((result['email_id'], hashes[result['email_id']], result['analysis']))
+        if len(batch) >= ANALYSIS_SAVE_EVERY:
+            saved += await asyncio.to_thread(save_analyses, batch)
+            batch = []
+    if batch:
+        saved += await asyncio.to_thread(save_analyses, batch)
+    return saved
+
+
+async def hydrate_recent(credentials: Credentials, emails: List[Dict[str, Any]]) -> int:
+    """
+    Baixa o corpo dos emails mais recentes que só têm metadados, no máximo
+    AI_INGEST_HYDRATE_MAX_ITEMS por rodada; as rodadas seguintes continuam
+    pelos mais antigos. Retorna quantos corpos foram baixados.
+    """
+    missing = [email for email in emails if not email.get('bodyLoaded', True)]
+    missing = missing[:settings.AI_INGEST_HYDRATE_MAX_ITEMS]
+    if not missing:
+        return 0
+    hydrated = await gmail_service.hydrate_bodies(credentials, missing)
+    return sum(1 for email in hydrated if email.get('bodyLoaded', True))
+
+
+async def ingest_mailbox(ai_service: AIService, credentials: Optional[Credentials] = None):
+    """
+    Baixa corpos, indexa e analisa a caixa atual (roda como BackgroundTask
+    após o sync). Sem credenciais, índice e análise usam o que já está no
+    armazenamento: o snippet para emails nunca abertos.
+
+    Chamadas concorrentes são coalescidas: se uma ingestão já está em
+    andamento, ela repete uma vez ao terminar em vez de rodar em paralelo.
+    """
+    global _pending, _credentials
+    if credentials is not None:
+        _credentials = credentials
+    if _lock.locked():
+        _pending = True
+        return
+
+    async with _lock:
+        while True:
+            _pending = False
+            mailbox = await aget_mailbox()
+            # Corpo antes do índice e da análise, para não trabalhar sobre o snippet
+            if _credentials is not None:
+                try:
+                    if await hydrate_recent(_credentials, mailbox.emails):
+                        mailbox = await aget_mailbox()
+                except Exception as e:
+                    print(f"Erro ao baixar corpos na ingestão: {e}")
+            # Cada etapa falha de forma independente
+            try:
+                await asyncio.to_thread(keyword_index.refresh, mailbox)
+                await ai_service.index_emails(mailbox.emails)
+            except Exception as e:
+                print(f"Erro na indexação de emails: {e}")
+            if settings.AI_INGEST_ANALYSIS:
+                try:
+                    await analyze_new_emails(ai_service, mailbox.emails)
+                except Exception as e:
+                    print(f"Erro na análise de emails na ingestão: {e}")
+            if not _pending:
+                return
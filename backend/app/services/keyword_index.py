@@ -0,0 +1,159 @@
+"""
+Índice invertido com ranking BM25 para busca por palavras-chave
+"""
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from collections import Counter
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+# Termos com 2+ caracteres, ou dígitos isolados
+_TOKEN_RE = re.compile(r'\w\w+|\d')
+
+# Palavras muito frequentes que não ajudam a ranquear (já sem acento)
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'da', 'das', 'de', 'do', 'dos', 'e', 'em', 'na', 'nas',
+    'no', 'nos', 'o', 'os', 'ou', 'para', 'pela', 'pelo', 'por', 'que', 'se', 'sem', 'um',
+    'uma', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'is', 'an', 're', 'fw', 'fwd',
+}
+
+
+def _build_fold_table() -> Dict[int, str]:
+    # Latin-1 e Latin Extended-A cobrem os acentos do português; o resto cai no NFKD
+    table = {}
+    for code in range(0xC0, 0x180):
+        folded = ''.join(
+            ch for ch in unicodedata.normalize('NFKD', chr(code)) if not unicodedata.combining(ch)
+        )
+        if folded != chr(code):
+            table[code] = folded
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold_accents(text: str) -> str:
+    """Remove acentos e cedilha ("reunião" -> "reuniao") e passa para minúsculas"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(_FOLD_TABLE)
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """Quebra o texto em termos sem acento, descartando stopwords"""
+    return [token for token in _TOKEN_RE.findall(fold_accents(text or '')) if token not in STOPWORDS]
+
+
+def keyword_text(email: Dict[str, Any]) -> str:
+    """Campos indexados de um email: assunto, remetente e corpo (ou snippet)"""
+    body = email.get('body') if email.get('bodyLoaded', True) else ''
+    return f"{email.get('subject', '')}\n{email.get('sender', '')}\n{body or email.get('snippet', '')}"
+
+
+class KeywordIndex:
+    """
+    Índice invertido em memória (termo -> {email_id: frequência}).
+
+    Atualizado de forma incremental: só emails cujo texto mudou são
+    retokenizados, e a busca percorre apenas as listas dos termos da consulta.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version: Optional[int] = None
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._docs: Dict[str, Tuple[int, Tuple[str, ...]]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _remove(self, email_id: str):
+        entry = self._docs.pop(email_id, None)
+        if entry is None:
+            return
+        for term in entry[1]:
+            postings = self._postings[term]
+            del postings[email_id]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(email_id)
+
+    def upsert(self, email_id: str, text: str):
+        """Indexa (ou reindexa) um email; nada muda se o texto for o mesmo"""
+        text_hash = hash(text)
+        with self._lock:
+            entry = self._docs.get(email_id)
+            if entry is not None and entry[0] == text_hash:
+                return
+            self._remove(email_id)
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[email_id] = tf
+            length = sum(terms.values())
+            self._docs[email_id] = (text_hash, tuple(terms))
+            self._doc_len[email_id] = length
+            self._total_len += length
+
+    def remove(self, email_ids: Iterable[str]):
+        with self._lock:
+            for email_id in email_ids:
+                self._remove(email_id)
+
+    def sync(self, emails: List[Dict[str, Any]], version: Optional[int] = None) -> Dict[str, int]:
+        """Alinha o índice com a lista completa de emails (upserts + remoções)"""
+        with self._lock:
+            current = set()
+            for email in emails:
+                current.add(email['id'])
+                self.upsert(email['id'], keyword_text(email))
+            stale = [email_id for email_id in self._docs if email_id not in current]
+            self.remove(stale)
+            self.version = version
+            return {"indexed": len(self._docs), "removed": len(stale)}
+
+    def refresh(self, mailbox) -> "KeywordIndex":
+        """Atualiza o índice se a visão da caixa mudou desde a última sincronização"""
+        if self.version != mailbox.version:
+            with self._lock:
+                if self.version != mailbox.version:
+                    self.sync(mailbox.emails, mailbox.version)
+        return self
+
+    def scores(self, query: str) -> Dict[str, float]:
+        """Pontuação BM25 de todos os emails que contêm algum termo da consulta"""
+        terms = set(tokenize(query))
+        with self._lock:
+            total_docs = len(self._docs)
+            if not terms or not total_docs:
+                return {}
+            avg_len = self._total_len / total_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for email_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[email_id] / avg_len)
+                    scores[email_id] = scores.get(email_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Top-k por BM25: [(email_id, score)]"""
+        return heapq.nlargest(k, self.scores(query).items(), key=lambda item: item[1])
+
+
+keyword_index = KeywordIndex()
@@ -0,0 +1,123 @@
+"""
+Estatísticas da caixa de email calculadas localmente (NumPy), sem o modelo
+"""
+from typing import Dict, Any, List
+from email.utils import parseaddr, parsedate_tz, mktime_tz
+from functools import lru_cache
+
+import numpy as np
+
+WEEKDAYS = ["segunda", "terça", "quarta", "quinta", "sexta", "sábado", "domingo"]
+# Faixas do histograma de tamanho de thread: 1, 2, 3-5, 6-10, 11+
+THREAD_BUCKETS = [(1, 1), (2, 2), (3, 5), (6, 10), (11, None)]
+TOP_N = 10
+
+
+def email_timestamp(email: Dict[str, Any]) -> float:
+    """Timestamp do cabeçalho Date (0 se ausente ou inválido)"""
+    try:
+        parsed = parsedate_tz(email.get('date', ''))
+        return float(mktime_tz(parsed)) if parsed else 0.0
+    except (TypeError, ValueError, OverflowError):
+        return 0.0
+
+
+@lru_cache(maxsize=65536)
+def sender_address(sender: str) -> str:
+    """Endereço do remetente em minúsculas ("Fulano <f@x.com>" -> "f@x.com")"""
+    address = parseaddr(sender or '')[1] or (sender or '')
+    return address.strip().lower()
+
+
+def _top_counts(values: np.ndarray, limit: int) -> List[Dict[str, Any]]:
+    if not values.size:
+        return []
+    unique, counts = np.unique(values, return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:limit]
+    return [{"value": str(unique[i]), "count": int(counts[i])} for i in order]
+
+
+def compute_mailbox_stats(emails: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Frequência de remetentes e domínios, volume por hora e dia da semana
+    (UTC), proporção de não lidos e distribuição do tamanho das threads.
+    """
+    total = len(emails)
+    if not total:
+        return {"total": 0}
+
+    senders = np.array([sender_address(email.get('sender', '')) for email in emails])
+    domains = np.array([address.rpartition('@')[2] for address in senders])
+    unread = np.fromiter((not email.get('isRead', True) for email in emails), dtype=bool, count=total)
+    timestamps = np.fromiter((email_timestamp(email) for email in emails), dtype=np.float64, count=total)
+    _, thread_sizes = np.unique(
+        np.array([email.get('threadId') or email.get('id', '') for email in emails]), return_counts=True
+    )
+
+    dated = timestamps[timestamps > 0].astype(np.int64)
+    by_hour = np.bincount((dated // 3600) % 24, minlength=24)
+    # 01/01/1970 foi uma quinta-feira (índice 3 com segunda = 0)
+    by_weekday = np.bincount((dated // 86400 + 3) % 7, minlength=7)
+
+    buckets = {}
+    for low, high in THREAD_BUCKETS:
+        mask = thread_sizes >= low if high is None else (thread_sizes >= low) & (thread_sizes <= high)
+        label = f"{low}+" if high is None else (str(low) if low == high else f"{low}-{high}")
+        buckets[label] = int(mask.sum())
+
+    return {
+        "total": total,
+        "unread": int(unread.sum()),
+        "unread_ratio": float(unread.mean()),
+        "unique_senders": int(np.unique(senders[senders != '']).size),
+        "top_senders": _top_counts(senders[senders != ''], TOP_N),
+        "top_domains": _top_counts(domains[domains != ''], TOP_N),
+        "by_hour": by_hour.tolist(),
+        "by_weekday": dict(zip(WEEKDAYS, by_weekday.tolist())),
+        "peak_hour": int(by_hour.argmax()) if dated.size else None,
+        "peak_weekday": WEEKDAYS[int(by_weekday.argmax())] if dated.size else None,
+        "first_date": float(dated.min()) if dated.size else None,
+        "last_date": float(dated.max()) if dated.size else None,
+        "threads": {
+            "count": int(thread_sizes.size),
+            "mean": float(thread_sizes.mean()),
+            "median": float(np.median(thread_sizes)),
+            "p90": float(np.percentile(thread_sizes, 90)),
+            "max": int(thread_sizes.max()),
+            "histogram": buckets,
+        },
+    }
+
+
+def frequent_senders(stats: Dict[str, Any], limit: int = 5) -> List[str]:
+    """Remetentes mais frequentes no formato "endereço (N emails)" """
+    return [f"{item['value']} ({item['count']} emails)" for item in stats.get("top_senders", [])[:limit]]
+
+
+def describe_patterns(stats: Dict[str, Any]) -> str:
+    """Descrição em texto dos padrões de comunicação calculados"""
+    if not stats.get("total"):
+        return "Nenhum email encontrado para análise"
+    parts = [f"{stats['total']} emails de {stats['unique_senders']} remetentes"]
+    if stats.get("peak_hour") is not None:
+        parts.append(f"pico de recebimento às {stats['peak_hour']}h (UTC), principalmente {stats['peak_weekday']}")
+    parts.append(f"{stats['unread_ratio']:.0%} não lidos")
+    threads = stats["threads"]
+    parts.append(f"threads com média de {threads['mean']:.1f} emails (máximo {threads['max']})")
+    if stats.get("top_domains"):
+        top = stats["top_domains"][0]
+        parts.append(f"domínio mais frequente: {top['value']} ({top['count'] / stats['total']:.0%})")
+    return "; ".join(parts)
+
+
+def format_stats_summary(stats: Dict[str, Any]) -> str:
+    """Resumo compacto das estatísticas para enviar ao modelo"""
+    if not stats.get("total"):
+        return "Caixa vazia."
+    senders = ", ".join(f"{item['value']} ({item['count']})" for item in stats["top_senders"][:5])
+    domains = ", ".join(f"{item['value']} ({item['count']})" for item in stats["top_domains"][:5])
+    return "\n".join([
+        describe_patterns(stats),
+        f"Remetentes mais frequentes: {senders}",
+        f"Domínios mais frequentes: {domains}",
+    ])
@@ -0,0 +1,111 @@
+"""
+Parser MIME para payloads da Gmail API
+"""
+from typing import Dict, Any, List, Optional, Tuple
+import base64
+import codecs
+import re
+
+from bs4 import BeautifulSoup
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+
+
+def build_header_map(headers: List[Dict[str, str]]) -> Dict[str, str]:
+    """Monta o dicionário de cabeçalhos (nomes em minúsculas, primeira ocorrência vence)"""
+    header_map: Dict[str, str] = {}
+    for header in headers or []:
+        name = header.get('name', '').lower()
+        if name and name not in header_map:
+            header_map[name] = header.get('value', '')
+    return header_map
+
+
+def _part_charset(part: Dict[str, Any]) -> str:
+    """Charset declarado no Content-Type da parte (utf-8 se ausente ou desconhecido)"""
+    for header in part.get('headers') or []:
+        if header.get('name', '').lower() == 'content-type':
+            match = _CHARSET_RE.search(header.get('value', ''))
+            if match:
+                try:
+                    return codecs.lookup(match.group(1)).name
+                except LookupError:
+                    break
+    return 'utf-8'
+
+
+def _is_attachment(part: Dict[str, Any]) -> bool:
+    if part.get('filename'):
+        return True
+    body = part.get('body') or {}
+    if body.get('attachmentId'):
+        return True
+    for header in part.get('headers') or []:
+        if header.get('name', '').lower() == 'content-disposition':
+            return header.get('value', '').lower().startswith('attachment')
+    return False
+
+
+def decode_part_data(data: str, charset: str = 'utf-8') -> str:
+    """Decodifica o base64url de uma parte respeitando o charset"""
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    return raw.decode(charset, errors='replace')
+
+
+def html_to_text(html: str) -> str:
+    """Converte HTML em texto simples"""
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['script', 'style', 'head']):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text('\n').splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def walk_payload(payload: Dict[str, Any]) -> Tuple[str, bool]:
+    """
+    Percorre a árvore MIME uma única vez, em ordem de documento.
+
+    Retorna (corpo em texto, tem anexos). Prefere o primeiro text/plain;
+    sem ele, converte o primeiro text/html. Anexos não são decodificados.
+    """
+    plain_part: Optional[Dict[str, Any]] = None
+    html_part: Optional[Dict[str, Any]] = None
+    has_attachments = False
+    stack = [payload]
+
+    while stack:
+        part = stack.pop()
+        if _is_attachment(part):
+            has_attachments = True
+            if plain_part is not None:
+                # Corpo e anexo já encontrados: o resto da árvore não muda o resultado
+                break
+            continue
+
+        children = part.get('parts')
+        if children:
+            # Pilha invertida para visitar as subpartes na ordem original
+            stack.extend(reversed(children))
+            continue
+
+        if plain_part is not None or not (part.get('body') or {}).get('data'):
+            continue
+        mime_type = part.get('mimeType', 'text/plain').lower()
+        if mime_type == 'text/plain':
+            plain_part = part
+            if has_attachments:
+                break
+        elif mime_type == 'text/html' and html_part is None:
+            html_part = part
+
+    if plain_part is not None:
+        return decode_part_data(plain_part['body']['data'], _part_charset(plain_part)), has_attachments
+    if html_part is not None:
+        html = decode_part_data(html_part['body']['data'], _part_charset(html_part))
+        return html_to_text(html), has_attachments
+    return "", has_attachments
+
+
+def extract_body(payload: Dict[str, Any]) -> str:
+    """Extrai o corpo em texto de um payload da Gmail API"""
+    return walk_payload(payload)[0]
@@ -0,0 +1,159 @@
+"""
+Montagem do contexto do chat (RAG) dentro de um orçamento de tokens
+"""
+from typing import Dict, Any, List, NamedTuple
+from collections import Counter
+import math
+import re
+
+from app.services.keyword_index import tokenize
+from app.services.token_budget import estimate_tokens, CHARS_PER_TOKEN
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n+')
+_SENTENCE_RE = re.compile(r'(?<=[.!?;])\s+')
+
+# Separadores entre trechos e emails ("\n[...]\n", "\n\n") contados por trecho
+SEPARATOR_TOKENS = 2
+# Peso da relevância do email (busca) na pontuação do trecho; o resto vem dos termos da consulta
+EMAIL_SCORE_WEIGHT = 0.5
+
+
+class Passage(NamedTuple):
+    email_index: int
+    position: int
+    text: str
+    tokens: int
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    # Parágrafo grande: quebra em frases e, se ainda não couber, em cortes fixos
+    pieces = []
+    current = ''
+    for sentence in _SENTENCE_RE.split(text):
+        while estimate_tokens(sentence) > max_tokens:
+            cut = max(max_tokens - 1, 1) * CHARS_PER_TOKEN
+            space = sentence.rfind(' ', 0, cut)
+            cut = space if space > cut // 2 else cut
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        candidate = f"{current} {sentence}".strip()
+        if current and estimate_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            candidate = sentence
+        current = candidate
+    if current:
+        pieces.append(current)
+    return [piece for piece in pieces if piece]
+
+
+def split_passages(text: str, max_tokens: int) -> List[str]:
+    """
+    Divide o texto em trechos de até max_tokens, respeitando parágrafos:
+    parágrafos curtos consecutivos são agrupados e os longos quebrados em frases.
+    """
+    passages = []
+    current = ''
+    for paragraph in _PARAGRAPH_RE.split(text or ''):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) > max_tokens:
+            if current:
+                passages.append(current)
+                current = ''
+            passages.extend(_split_long(paragraph, max_tokens))
+            continue
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if current and estimate_tokens(candidate) > max_tokens:
+            passages.append(current)
+            candidate = paragraph
+        current = candidate
+    if current:
+        passages.append(current)
+    return passages
+
+
+def email_header(metadata: Dict[str, Any]) -> str:
+    """Cabeçalho de um email no contexto do chat"""
+    return f"Assunto: {metadata.get('subject', '')}\nDe: {metadata.get('sender', '')}\nData: {metadata.get('date', '')}"
+
+
+def _rank_passages(query: str, passages: List[Passage], email_scores: List[float]) -> List[float]:
+    # BM25 simplificado entre os próprios trechos, combinado com a relevância do email
+    terms = set(tokenize(query))
+    tokenized = [Counter(tokenize(passage.text)) for passage in passages]
+    total = len(passages)
+    df = Counter(term for counts in tokenized for term in terms if term in counts)
+    avg_len = sum(sum(counts.values()) for counts in tokenized) / total or 1.0
+
+    lexical = []
+    for counts in tokenized:
+        length = sum(counts.values())
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if tf:
+                idf = math.log(1 + (total - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / avg_len))
+        lexical.append(score)
+
+    top_lexical = max(lexical) or 1.0
+    top_email = max(email_scores) or 1.0
+    return [
+        EMAIL_SCORE_WEIGHT * email_scores[passage.email_index] / top_email
+        + (1 - EMAIL_SCORE_WEIGHT) * lexical[i] / top_lexical
+        for i, passage in enumerate(passages)
+    ]
+
+
+def build_rag_context(
+    query: str,
+    candidates: List[Dict[str, Any]],
+    token_budget: int,
+    passage_tokens: int
+) -> Dict[str, Any]:
+    """
+    Escolhe os melhores trechos dos emails candidatos até o orçamento de tokens.
+
+    candidates: [{text, metadata}] na ordem da busca, com metadata['score'].
+    O cabeçalho de cada email entra (e é contado) uma vez, junto com o
+    primeiro trecho escolhido dele. Retorna {context, sources, tokens}.
+    """
+    passages: List[Passage] = []
+    for email_index, candidate in enumerate(candidates):
+        for position, text in enumerate(split_passages(candidate['text'], passage_tokens)):
+            passages.append(Passage(email_index, position, text, estimate_tokens(text)))
+    if not passages:
+        return {"context": "", "sources": [], "tokens": 0}
+
+    email_scores = [max(float(candidate['metadata'].get('score') or 0.0), 0.0) for candidate in candidates]
+    scores = _rank_passages(query, passages, email_scores)
+
+    headers = [email_header(candidate['metadata']) for candidate in candidates]
+    selected: Dict[int, List[Passage]] = {}
+    used = 0
+    for i in sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i].email_index, passages[i].position)):
+        passage = passages[i]
+        cost = passage.tokens + SEPARATOR_TOKENS
+        if passage.email_index not in selected:
+            cost += estimate_tokens(headers[passage.email_index])
+        if used + cost > token_budget:
+            continue
+        selected.setdefault(passage.email_index, []).append(passage)
+        used += cost
+
+    # Emails na ordem da busca; trechos na ordem original dentro do email
+    blocks = []
+    sources = []
+    for email_index in sorted(selected):
+        chosen = sorted(selected[email_index], key=lambda passage: passage.position)
+        blocks.append(headers[email_index] + "\n" + "\n[...]\n".join(passage.text for passage in chosen))
+        metadata = candidates[email_index]['metadata']
+        excerpt = chosen[0].text
+        sources.append({
+            'subject': metadata.get('subject', ''),
+            'sender': metadata.get('sender', ''),
+            'date': metadata.get('date', ''),
+            'content': excerpt[:200] + "..." if len(excerpt) > 200 else excerpt
+        })
+    return {"context": "\n\n".join(blocks), "sources": sources, "tokens": used}
@@ -0,0 +1,145 @@
+"""
+Cache semântico de respostas do chat, isolado por usuário
+"""
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.analysis_cache import normalize_content
+
+
+def sources_key(sources: Iterable[Tuple[str, str]], context: str = "") -> str:
+    """Chave do conjunto de fontes recuperadas: (email_id, hash do texto) + contexto do usuário"""
+    digest = hashlib.sha256()
+    for email_id, content_hash in sorted(sources):
+        digest.update(f"{email_id}:{content_hash}".encode('utf-8'))
+        digest.update(b'\x00')
+    digest.update(normalize_content(context).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("query", "vector", "response", "created_at")
+
+    def __init__(self, query: str, vector: Optional[np.ndarray], response: str, created_at: float):
+        self.query = query
+        self.vector = vector
+        self.response = response
+        self.created_at = created_at
+
+
+class SemanticResponseCache:
+    """
+    Respostas anteriores por usuário e conjunto de fontes. Uma pergunta nova
+    reaproveita a resposta se as fontes recuperadas forem as mesmas e o
+    embedding da pergunta tiver similaridade de cosseno >= threshold com o de
+    uma pergunta já respondida (sem embedding, só o texto idêntico conta).
+
+    LRU em memória: no máximo max_entries por usuário e max_users usuários.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: float, max_entries: int, max_users: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_users = max_users
+        # usuário -> (chave das fontes -> entradas), ambos em ordem de uso
+        self._users: "OrderedDict[str, OrderedDict[str, List[_Entry]]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def _normalize(vector: Optional[List[float]]) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm else None
+
+    def _match(self, entries: List[_Entry], query: str, vector: Optional[np.ndarray], now: float) -> Optional[_Entry]:
+        best, best_score = None, self.threshold
+        for entry in entries:
+            if now - entry.created_at >= self.ttl_seconds:
+                continue
+            if entry.query == query:
+                return entry
+            if vector is not None and entry.vector is not None and entry.vector.shape == vector.shape:
+                score = float(entry.vector @ vector)
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best
+
+    def get(self, user_key: str, key: str, query: str, vector: Optional[List[float]]) -> Optional[str]:
+        """Resposta em cache para uma pergunta equivalente com as mesmas fontes, ou None"""
+        query = normalize_content(query).lower()
+        normalized = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            buckets = self._users.get(user_key)
+            entries = buckets.get(key) if buckets is not None else None
+            entry = self._match(entries, query, normalized, now) if entries else None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._users.move_to_end(user_key)
+            buckets.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry.response
+
+    def put(self, user_key: str, key: str, query: str, vector: Optional[List[float]], response: str):
+        """Guarda a resposta; descarta as entradas menos usadas acima dos limites"""
+        entry = _Entry(normalize_content(query).lower(), self._normalize(vector), response, time.time())
+        with self._lock:
+            buckets = self._users.setdefault(user_key, OrderedDict())
+            self._users.move_to_end(user_key)
+            entries = buckets.setdefault(key, [])
+            buckets.move_to_end(key)
+            entries.append(entry)
+            self._sizes[user_key] = self._sizes.get(user_key, 0) + 1
+            self._stats["writes"] += 1
+
+            while self._sizes[user_key] > self.max_entries:
+                oldest_key, oldest = next(iter(buckets.items()))
+                oldest.pop(0)
+                if not oldest:
+                    del buckets[oldest_key]
+                self._sizes[user_key] -= 1
+                self._stats["evictions"] += 1
+            while len(self._users) > self.max_users:
+                evicted_user, _ = self._users.popitem(last=False)
+                self._stats["evictions"] += self._sizes.pop(evicted_user, 0)
+
+    def clear(self, user_key: Optional[str] = None):
+        """Esvazia o cache de um usuário (ou de todos)"""
+        with self._lock:
+            if user_key is None:
+                self._users.clear()
+                self._sizes.clear()
+            else:
+                self._users.pop(user_key, None)
+                self._sizes.pop(user_key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores de acerto, falta, escrita e descarte, com a taxa de acerto"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+                "users": len(self._users),
+                "entries": sum(self._sizes.values()),
+            }
+
+
+chat_response_cache = SemanticResponseCache(
+    threshold=settings.CHAT_CACHE_SIMILARITY,
+    ttl_seconds=settings.CHAT_CACHE_TTL_SECONDS,
+    max_entries=settings.CHAT_CACHE_MAX_ENTRIES_PER_USER,
+    max_users=settings.CHAT_CACHE_MAX_USERS
+)
@@ -0,0 +1,55 @@
+"""
+Memoização por versão com coalescência de chamadas concorrentes (single-flight)
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class VersionedSingleFlight:
+    """
+    Guarda o resultado da última versão calculada. Pedidos concorrentes para
+    a mesma versão aguardam uma única computação em andamento; falhas (e
+    resultados recusados por cacheable) não são memoizados.
+    """
+
+    def __init__(self):
+        self._version: Optional[Hashable] = None
+        self._value: Any = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def _done(self, version: Hashable, task: asyncio.Future, cacheable: Optional[Callable[[Any], bool]]):
+        self._inflight.pop(version, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if cacheable is None or cacheable(task.result()):
+            self._version = version
+            self._value = task.result()
+
+    async def get(
+        self,
+        version: Hashable,
+        compute: Callable[[], Awaitable[T]],
+        cacheable: Optional[Callable[[T], bool]] = None
+    ) -> T:
+        """Resultado para a versão, calculando no máximo uma vez por vez"""
+        if self._version == version:
+            self._stats["hits"] += 1
+            return self._value
+
+        task = self._inflight.get(version)
+        if task is None:
+            self._stats["misses"] += 1
+            task = asyncio.ensure_future(compute())
+            self._inflight[version] = task
+            task.add_done_callback(lambda done: self._done(version, done, cacheable))
+        else:
+            self._stats["coalesced"] += 1
+        # Um cliente que desconecta não cancela a computação dos demais
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores de acerto, cálculo e coalescência"""
+        return {**self._stats, "version": self._version, "inflight": len(self._inflight)}
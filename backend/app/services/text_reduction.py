@@ -0,0 +1,274 @@
+"""
+Redução de texto antes das chamadas ao modelo: remove histórico citado,
+assinaturas, avisos legais e ruído de links de rastreamento
+"""
+from typing import Dict, Any, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlsplit, parse_qsl
+import hashlib
+import re
+
+from app.services.token_budget import estimate_tokens
+
+# Cabeçalhos que introduzem o histórico citado; tudo abaixo deles é descartado.
+# O Gmail quebra "Em <data>, <nome> escreveu:" em duas linhas com frequência,
+# por isso o cabeçalho pode ocupar até duas linhas vizinhas e termina a linha.
+_REPLY_HEADER_RE = re.compile(
+    r'^[ \t]*('
+    r'(?P<attribution>(em|on)\s[^\n]{0,200}?(\n[^\n]{0,200}?)?(escreveu|wrote)[ \t]*:)[ \t]*$'
+    r'|-{2,}\s*(mensagem original|original message)\s*-{2,}'
+    r'|_{10,}'
+    r'|(de|from)\s*:.{0,200}\n\s*(enviad[oa]|sent|data|date)\s*:'
+    r')',
+    re.IGNORECASE | re.MULTILINE
+)
+_QUOTED_LINE_RE = re.compile(r'^\s*>.*$\n?', re.MULTILINE)
+# "-- " (com o espaço) é o delimitador padrão de assinatura (RFC 3676);
+# "--" sozinho é só um divisor dentro do texto
+_SIGNATURE_DELIMITER_RE = re.compile(r'^-- $', re.MULTILINE)
+_MOBILE_SIGNATURE_RE = re.compile(
+    r'^\s*(enviado do meu|enviado de meu|sent from my|get outlook for)\b.*$', re.IGNORECASE | re.MULTILINE
+)
+_VALEDICTION_RE = re.compile(
+    r'^\s*(atenciosamente|att\.?|atte\.?|abraços?|abs\.?|cordialmente|saudações|'
+    r'obrigad[oa]s?|best regards|kind regards|regards|best|cheers|thanks|thank you)\s*[,.!]?\s*$',
+    re.IGNORECASE
+)
+_GREETING_RE = re.compile(
+    r'^\s*(oi|olá|ola|prezad[oa]s?|car[oa]s?|bom dia|boa tarde|boa noite|hi|hello|hey|dear)\b[^.!?\n]{0,40}[,!:]?\s*$',
+    re.IGNORECASE
+)
+# Telefone, email ou endereço web: linha típica de assinatura, qualquer que seja o tamanho
+_CONTACT_RE = re.compile(
+    r'(\+?\d[\d\s().-]{6,}\d|[\w.+-]+@[\w-]+\.[\w.]+|\bwww\.|https?://)', re.IGNORECASE
+)
+# Rodapés só são reconhecidos pelo começo do parágrafo, não por palavras soltas
+_FOOTER_RE = re.compile(
+    r'^\s*('
+    r'(aviso( legal)?|confidencialidade|disclaimer|confidentiality notice)\s*:'
+    r'|esta (mensagem|comunicação)( e (seus|quaisquer) anexos)? (é|são|pode|podem|contém)\b'
+    r'|este e-?mail( e (seus|quaisquer) anexos)? (é|pode|contém)\b'
+    r'|(this|the information in this) (e-?mail|message|communication)( and any attachments)? (is|are|may|contains)\b'
+    r'|você está recebendo (este|esse)\b'
+    r'|you are receiving this\b'
+    r'|(para|clique aqui para) (cancelar|descadastrar|deixar de receber)\b'
+    r'|to (unsubscribe|stop receiving)\b'
+    r'|(unsubscribe|descadastre-se|manage (your )?preferences)\s*[:|]'
+    r')',
+    re.IGNORECASE
+)
+_DELIMITER_LINE_RE = re.compile(r'^\s*([-_=*~]\s*){3,}$')
+_URL_RE = re.compile(r'https?://([^/\s<>"\']+)[^\s<>"\']*', re.IGNORECASE)
+# Parâmetros de campanha e identificadores de clique
+_TRACKING_PARAM_RE = re.compile(
+    r'^(utm_\w+|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|_hsenc|_hsmi|mkt_tok|trk|trkid|yclid|igshid)$',
+    re.IGNORECASE
+)
+# Serviços de redirecionamento de cliques de email marketing e proteção de links
+_TRACKER_HOST_RE = re.compile(
+    r'(^|\.)(list-manage\.com|sendgrid\.net|mandrillapp\.com|mailchimp\.com|hubspotlinks\.com|'
+    r'safelinks\.protection\.outlook\.com|urldefense\.com|mailgun\.org|mjt\.lu|rs6\.net|'
+    r'exct\.net|click\.[\w.-]+|clicks\.[\w.-]+|links?\.[\w.-]+\.\w+|track(ing)?\.[\w.-]+)$',
+    re.IGNORECASE
+)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Uma saudação final só encerra o email se vier perto do fim
+SIGNATURE_MAX_LINES = 8
+# Linhas de nome/cargo/empresa depois da saudação final são curtas
+SIGNATURE_LINE_MAX_CHARS = 60
+SIGNATURE_LINE_MAX_WORDS = 6
+# Avisos legais e rodapés de lista têm pelo menos uma frase completa
+FOOTER_MIN_CHARS = 60
+# Query string acima disso é identificador de rastreamento, não endereço de documento
+URL_QUERY_MAX_CHARS = 120
+
+
+class ReductionResult(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _is_signature_line(line: str) -> bool:
+    """Linha curta de nome, cargo ou contato (não uma frase do corpo)"""
+    line = line.strip()
+    if not line or _CONTACT_RE.search(line):
+        return True
+    return (
+        len(line) <= SIGNATURE_LINE_MAX_CHARS
+        and len(line.split()) <= SIGNATURE_LINE_MAX_WORDS
+        and not line.endswith(('.', '!', '?', ':'))
+    )
+
+
+def _has_body(lines: List[str]) -> bool:
+    """Há texto de verdade além de saudações iniciais e finais"""
+    return any(
+        line.strip() and not _GREETING_RE.match(line) and not _VALEDICTION_RE.match(line)
+        for line in lines
+    )
+
+
+def _is_signature_tail(lines: List[str]) -> bool:
+    return len(lines) <= SIGNATURE_MAX_LINES and all(_is_signature_line(line) for line in lines)
+
+
+def _strip_signature(text: str) -> str:
+    # "-- " só encerra o corpo se o que vem depois tiver forma de assinatura
+    for match in _SIGNATURE_DELIMITER_RE.finditer(text):
+        if _is_signature_tail(text[match.end():].strip('\n').split('\n')):
+            text = text[:match.start()]
+            break
+
+    lines = text.rstrip().split('\n')
+    # "Enviado do meu ..." só vale nas últimas linhas
+    tail = max(len(lines) - SIGNATURE_MAX_LINES, 0)
+    for index in range(len(lines) - 1, tail - 1, -1):
+        if _MOBILE_SIGNATURE_RE.match(lines[index]):
+            lines = lines[:index]
+            text = '\n'.join(lines)
+            break
+
+    lines = text.rstrip().split('\n')
+    # Saudação final com corpo antes e só nome/cargo/contato depois: corta depois dela
+    for index in range(len(lines) - 1, max(-1, len(lines) - SIGNATURE_MAX_LINES - 2), -1):
+        if _VALEDICTION_RE.match(lines[index]):
+            if _has_body(lines[:index]) and all(_is_signature_line(line) for line in lines[index + 1:]):
+                return '\n'.join(lines[:index + 1])
+            break
+    return text
+
+
+def _is_signature_block(paragraph: str) -> bool:
+    lines = [line for line in paragraph.split('\n') if line.strip()]
+    if not lines or len(lines) > SIGNATURE_MAX_LINES or _GREETING_RE.match(lines[0]):
+        return False
+    return any(_VALEDICTION_RE.match(line) for line in lines) or all(_is_signature_line(line) for line in lines)
+
+
+def _split_delimiter(paragraph: str) -> Tuple[bool, str]:
+    first, _, rest = paragraph.lstrip('\n').partition('\n')
+    if _DELIMITER_LINE_RE.match(first):
+        return True, rest
+    return False, paragraph
+
+
+def _is_footer(paragraph: str) -> bool:
+    text = _split_delimiter(paragraph)[1].strip()
+    return len(text) >= FOOTER_MIN_CHARS and bool(_FOOTER_RE.match(text))
+
+
+def _strip_disclaimers(text: str) -> str:
+    paragraphs = _BLANK_LINES_RE.split(text)
+    # Avisos legais e rodapés ficam no fim, depois da assinatura ou de uma linha separadora
+    end = len(paragraphs)
+    while end > 1 and _is_footer(paragraphs[end - 1]):
+        end -= 1
+    if end == len(paragraphs):
+        return text
+
+    previous = paragraphs[end - 1]
+    if _DELIMITER_LINE_RE.match(previous):
+        cut = end - 1
+        placed = cut >= 1 and _has_body(paragraphs[:cut])
+    else:
+        cut = end
+        placed = (
+            _split_delimiter(paragraphs[end])[0] and _has_body(paragraphs[:end])
+        ) or (end >= 2 and _is_signature_block(previous) and _has_body(paragraphs[:end - 1]))
+    return '\n\n'.join(paragraphs[:cut]) if placed else text
+
+
+def _is_tracking_url(url: str) -> bool:
+    """Link de rastreamento ou redirecionamento (não o endereço de um documento ou página)"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    if _TRACKER_HOST_RE.search(parts.hostname or ''):
+        return True
+    if len(parts.query) > URL_QUERY_MAX_CHARS:
+        return True
+    return any(_TRACKING_PARAM_RE.match(name) for name, _ in parse_qsl(parts.query, keep_blank_values=True))
+
+
+def _shorten_url(match: re.Match) -> str:
+    url = match.group(0)
+    return f"[link {match.group(1).lower()}]" if _is_tracking_url(url) else url
+
+
+def _reply_header_start(text: str) -> Optional[int]:
+    # "Em/On <data>, <nome> escreveu/wrote:" sempre traz a data; sem dígitos é só uma frase do corpo
+    for match in _REPLY_HEADER_RE.finditer(text):
+        attribution = match.group('attribution')
+        if attribution is None or any(char.isdigit() for char in attribution):
+            return match.start()
+    return None
+
+
+def strip_email_noise(text: str) -> str:
+    """Remove histórico citado, assinatura, avisos legais e links de rastreamento de um corpo de email"""
+    if not text:
+        return ''
+    text = text.replace('\r\n', '\n')
+    start = _reply_header_start(text)
+    if start:
+        text = text[:start]
+    text = _QUOTED_LINE_RE.sub('', text)
+    text = _strip_disclaimers(text)
+    text = _strip_signature(text)
+    text = _URL_RE.sub(_shorten_url, text)
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def reduce_text(text: str) -> ReductionResult:
+    """Aplica strip_email_noise e informa os tokens estimados antes e depois"""
+    reduced = strip_email_noise(text)
+    return ReductionResult(reduced, estimate_tokens(text), estimate_tokens(reduced))
+
+
+def _paragraph_key(paragraph: str) -> str:
+    return hashlib.sha1(_WHITESPACE_RE.sub(' ', paragraph).strip().lower().encode('utf-8')).hexdigest()
+
+
+def dedupe_paragraphs(texts: List[str], min_chars: int = 40) -> List[str]:
+    """
+    Remove de cada texto os parágrafos que já apareceram nos anteriores
+    (conteúdo repetido entre mensagens da mesma thread). Parágrafos curtos,
+    como saudações, são mantidos.
+    """
+    seen: Set[str] = set()
+    result = []
+    for text in texts:
+        kept = []
+        for paragraph in _BLANK_LINES_RE.split(text or ''):
+            if len(paragraph.strip()) < min_chars:
+                kept.append(paragraph)
+                continue
+            key = _paragraph_key(paragraph)
+            if key not in seen:
+                seen.add(key)
+                kept.append(paragraph)
+        result.append('\n\n'.join(p for p in kept if p.strip()))
+    return result
+
+
+def reduce_thread(emails: List[Dict[str, Any]], field: str = 'body') -> List[ReductionResult]:
+    """Reduz o campo de cada email (em ordem cronológica) e remove o que se repete na mesma thread"""
+    reduced = [strip_email_noise(email.get(field) or '') for email in emails]
+    by_thread: Dict[str, List[int]] = {}
+    for index, email in enumerate(emails):
+        by_thread.setdefault(email.get('threadId') or email.get('id', ''), []).append(index)
+    for indexes in by_thread.values():
+        if len(indexes) > 1:
+            for index, text in zip(indexes, dedupe_paragraphs([reduced[i] for i in indexes])):
+                reduced[index] = text
+    return [
+        ReductionResult(text, estimate_tokens(email.get(field) or ''), estimate_tokens(text))
+        for email, text in zip(emails, reduced)
+    ]
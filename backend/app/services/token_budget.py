@@ -0,0 +1,41 @@
+"""
+Estimativa local de tokens e empacotamento de itens por orçamento
+"""
+from typing import List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Média observada para o Gemini em texto pt/en: ~4 caracteres por token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata do número de tokens de um texto, sem chamar a API"""
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_by_budget(
+    items: Sequence[Tuple[str, str]],
+    token_budget: int,
+    max_items: int
+) -> List[List[Tuple[str, str]]]:
+    """
+    Agrupa (id, texto) em lotes cujo total estimado cabe no orçamento.
+
+    Um item maior que o orçamento vai sozinho no seu lote.
+    """
+    groups: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    used = 0
+    for item in items:
+        cost = estimate_tokens(item[1])
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            groups.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
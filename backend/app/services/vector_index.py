@@ -0,0 +1,211 @@
+"""
+Índice vetorial persistido em disco (matriz NumPy + metadados em JSON)
+"""
+from typing import Dict, Any, List, Optional, Set, Tuple, Sequence
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+
+
+def embedding_text(email: Dict[str, Any]) -> str:
+    """Texto indexado de um email: assunto, remetente e corpo (ou snippet, se o corpo não foi baixado)"""
+    body = email.get('body') if email.get('bodyLoaded', True) else ''
+    text = (
+        f"Assunto: {email.get('subject', '')}\n"
+        f"De: {email.get('sender', '')}\n\n"
+        f"{body or email.get('snippet', '')}"
+    )
+    return text[:settings.EMBEDDING_MAX_CHARS]
+
+
+def text_hash(text: str) -> str:
+    """Hash do texto indexado; só emails com hash novo são reenviados ao modelo"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class VectorIndex:
+    """
+    Matriz de embeddings normalizados, uma linha por email.
+
+    A busca é um produto matricial seguido de argpartition, o que mantém
+    consultas em milissegundos mesmo com ~100k emails.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim: Optional[int] = None
+        self.model: Optional[str] = None
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._hashes: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty = False
+
+    @property
+    def _matrix_file(self) -> str:
+        return f"{self.path}.npy"
+
+    @property
+    def _meta_file(self) -> str:
+        return f"{self.path}.json"
+
+    def load(self):
+        """Carrega o índice do disco (uma única vez)"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not (os.path.exists(self._matrix_file) and os.path.exists(self._meta_file)):
+                return
+            try:
+                with open(self._meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                matrix = np.load(self._matrix_file)
+            except (OSError, ValueError) as e:
+                print(f"Erro ao carregar índice vetorial: {e}")
+                return
+            self.model = meta.get('model')
+            self._ids = meta['ids']
+            self._hashes = meta['hashes']
+            self._rows = {email_id: row for row, email_id in enumerate(self._ids)}
+            self._matrix = matrix.astype(np.float32, copy=False)
+            self._size = len(self._ids)
+            self.dim = matrix.shape[1] if matrix.ndim == 2 and matrix.shape[0] else None
+
+    def save(self):
+        """Grava o índice em disco se houve mudanças (escrita atômica)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            matrix_tmp = f"{self.path}.tmp.npy"
+            meta_tmp = f"{self.path}.tmp.json"
+            np.save(matrix_tmp, self._matrix[:self._size])
+            with open(meta_tmp, 'w', encoding='utf-8') as f:
+                json.dump({'model': self.model, 'ids': self._ids, 'hashes': self._hashes}, f)
+            os.replace(matrix_tmp, self._matrix_file)
+            os.replace(meta_tmp, self._meta_file)
+            self._dirty = False
+
+    def reset(self, model: str):
+        """Descarta os vetores (ex.: troca do modelo de embedding)"""
+        with self._lock:
+            self.model = model
+            self.dim = None
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+            self._size = 0
+            self._ids, self._hashes, self._rows = [], [], {}
+            self._dirty = True
+
+    def hash_of(self, email_id: str) -> Optional[str]:
+        row = self._rows.get(email_id)
+        return self._hashes[row] if row is not None else None
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._ids)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, needed: int):
+        if self._matrix.shape[0] >= needed:
+            return
+        capacity = max(needed, self._matrix.shape[0] * 2, 1024)
+        grown = np.zeros((capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def upsert(self, entries: Sequence[Tuple[str, str, Sequence[float]]]):
+        """Insere ou substitui vetores: (email_id, hash do texto, embedding)"""
+        if not entries:
+            return
+        vectors = np.asarray([entry[2] for entry in entries], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+            self._ensure_capacity(self._size + len(entries))
+            for (email_id, text_hash, _), vector in zip(entries, vectors):
+                row = self._rows.get(email_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[email_id] = row
+                    self._ids.append(email_id)
+                    self._hashes.append(text_hash)
+                else:
+                    self._hashes[row] = text_hash
+                self._matrix[row] = vector
+            self._dirty = True
+
+    def remove(self, email_ids: Sequence[str]):
+        """Remove vetores trocando a linha pela última (O(1) por remoção)"""
+        with self._lock:
+            for email_id in email_ids:
+                row = self._rows.pop(email_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = self._ids[last]
+                    self._hashes[row] = self._hashes[last]
+                    self._rows[self._ids[row]] = row
+                self._ids.pop()
+                self._hashes.pop()
+                self._size -= 1
+                self._dirty = True
+
+    def search(
+        self,
+        query_vector: Sequence[float],
+        k: int,
+        within: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-k por similaridade de cosseno: [(email_id, score)], opcionalmente só entre os ids em within"""
+        with self._lock:
+            if not self._size:
+                return []
+            # Cópia: o vetor de quem chama é reaproveitado em outras buscas
+            query = np.array(query_vector, dtype=np.float32, copy=True)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._matrix[:self._size] @ query
+            rows = np.arange(self._size)
+            if within is not None:
+                rows = np.fromiter(
+                    (self._rows[email_id] for email_id in within if email_id in self._rows), dtype=np.int64
+                )
+                if not rows.size:
+                    return []
+                scores = scores[rows]
+            k = min(k, rows.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+    def scores_for(self, query_vector: Sequence[float], email_ids: Sequence[str]) -> Dict[str, float]:
+        """Similaridade da consulta só com os emails indicados (os não indexados são omitidos)"""
+        with self._lock:
+            rows = [self._rows[email_id] for email_id in email_ids if email_id in self._rows]
+            if not rows:
+                return {}
+            # Cópia: o vetor de quem chama é reaproveitado em outras buscas
+            query = np.array(query_vector, dtype=np.float32, copy=True)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._matrix[rows] @ query
+            return {self._ids[row]: score for row, score in zip(rows, scores.tolist())}
+
+
+vector_index = VectorIndex(settings.VECTOR_INDEX_PATH)
@@ -0,0 +1,70 @@
+"""
+Benchmark do índice BM25 contra a varredura linear por substring com 100k emails
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_keyword_search
+"""
+import random
+import time
+
+from app.services.keyword_index import KeywordIndex
+
+EMAILS = 100_000
+QUERIES = 200
+VOCABULARY = [
+    "reunião", "orçamento", "fatura", "relatório", "projeto", "cliente", "contrato",
+    "viagem", "entrega", "pagamento", "ação", "prazo", "equipe", "proposta", "revisão",
+] + [f"termo{i}" for i in range(5000)]
+
+
+def build_corpus(rng: random.Random):
+    return [
+        {
+            'id': str(i),
+            'subject': " ".join(rng.choices(VOCABULARY, k=6)),
+            'sender': f"pessoa{rng.randrange(2000)}@example.com",
+            'body': " ".join(rng.choices(VOCABULARY, k=120)),
+            'bodyLoaded': True,
+        }
+        for i in range(EMAILS)
+    ]
+
+
+def linear_scan(emails, query):
+    query_lower = query.lower()
+    return [
+        email for email in emails
+        if query_lower in email['subject'].lower() or query_lower in email['body'].lower()
+    ][:10]
+
+
+def main():
+    rng = random.Random(0)
+    emails = build_corpus(rng)
+    queries = [" ".join(rng.choices(VOCABULARY[:15], k=2)) for _ in range(QUERIES)]
+
+    index = KeywordIndex()
+    start = time.perf_counter()
+    index.sync(emails)
+    print(f"construção do índice ({EMAILS} emails): {time.perf_counter() - start:.2f} s")
+
+    changed = emails[:100]
+    for email in changed:
+        email['subject'] += " alterado"
+    start = time.perf_counter()
+    index.sync(emails)
+    print(f"sincronização com 100 alterados: {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, 10)
+    print(f"BM25 top-10: {(time.perf_counter() - start) / QUERIES * 1000:.2f} ms/consulta")
+
+    start = time.perf_counter()
+    for query in queries[:20]:
+        linear_scan(emails, query)
+    print(f"varredura linear: {(time.perf_counter() - start) / 20 * 1000:.2f} ms/consulta")
+
+
+if __name__ == "__main__":
+    main()
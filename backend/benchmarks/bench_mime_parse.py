@@ -0,0 +1,77 @@
+"""
+Benchmark do parser MIME sobre um corpus sintético de mensagens multipart grandes
+
+Cada mensagem tem multipart/mixed > multipart/alternative (text/plain + text/html),
+um anexo grande com dados embutidos e cabeçalhos extensos. Parte do corpus é
+só-HTML e parte usa charset ISO-8859-1.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_mime_parse
+"""
+import base64
+import time
+
+from app.services.gmail_service import GmailService
+
+MESSAGES = 500
+BODY_PARAGRAPHS = 200
+ATTACHMENT_BYTES = 256 * 1024
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _part(mime_type: str, data: bytes, charset: str = 'utf-8', filename: str = ''):
+    headers = [{'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}]
+    if filename:
+        headers.append({'name': 'Content-Disposition', 'value': f'attachment; filename="{filename}"'})
+    return {'mimeType': mime_type, 'filename': filename, 'headers': headers, 'body': {'data': _b64(data)}}
+
+
+def build_corpus():
+    text = "\n\n".join(f"Parágrafo {i}: reunião de orçamento às 14h." for i in range(BODY_PARAGRAPHS))
+    html = "<html><body>" + "".join(f"<p>{p}</p>" for p in text.split("\n\n")) + "</body></html>"
+    attachment = b"\x00\x01" * (ATTACHMENT_BYTES // 2)
+    headers = [{'name': f'X-Header-{i}', 'value': 'x' * 80} for i in range(40)] + [
+        {'name': 'Subject', 'value': 'Relatório'},
+        {'name': 'From', 'value': 'Financeiro <fin@example.com>'},
+        {'name': 'Date', 'value': 'Mon, 13 Oct 2025 10:00:00 +0000'},
+    ]
+
+    corpus = []
+    for i in range(MESSAGES):
+        if i % 5 == 0:
+            alternative = [_part('text/html', html.encode('utf-8'))]
+        elif i % 5 == 1:
+            alternative = [_part('text/plain', text.encode('latin-1'), charset='iso-8859-1')]
+        else:
+            alternative = [_part('text/plain', text.encode('utf-8')), _part('text/html', html.encode('utf-8'))]
+        payload = {
+            'mimeType': 'multipart/mixed',
+            'headers': headers,
+            'body': {},
+            'parts': [
+                {'mimeType': 'multipart/alternative', 'headers': [], 'body': {}, 'parts': alternative},
+                _part('application/pdf', attachment, filename='anexo.pdf'),
+            ],
+        }
+        corpus.append({'id': str(i), 'threadId': str(i), 'labelIds': ['INBOX'], 'snippet': '', 'payload': payload})
+    return corpus
+
+
+def main():
+    corpus = build_corpus()
+    gmail_service = GmailService()
+
+    start = time.perf_counter()
+    parsed = [gmail_service._parse_email_message(message) for message in corpus]
+    elapsed = time.perf_counter() - start
+
+    empty = sum(1 for email in parsed if not email['body'])
+    print(f"{MESSAGES} mensagens em {elapsed:.3f} s ({elapsed / MESSAGES * 1000:.3f} ms/mensagem)")
+    print(f"mensagens sem corpo extraído: {empty}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark da busca top-k no índice vetorial com 100k emails
+
+Vetores aleatórios de 768 dimensões (a dimensão do text-embedding-004),
+gravados e recarregados do disco para medir também o custo de carga.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_vector_search
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.vector_index import VectorIndex
+
+EMAILS = 100_000
+DIM = 768
+QUERIES = 200
+K = 10
+
+
+def main():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((EMAILS, DIM), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(os.path.join(tmp, "vectors"))
+        index.load()
+        start = time.perf_counter()
+        index.upsert([(str(i), "", vector) for i, vector in enumerate(vectors)])
+        print(f"inserção de {EMAILS} vetores: {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        index.save()
+        print(f"gravação: {time.perf_counter() - start:.2f} s")
+
+        reloaded = VectorIndex(index.path)
+        start = time.perf_counter()
+        reloaded.load()
+        print(f"carga: {time.perf_counter() - start:.2f} s ({len(reloaded)} vetores)")
+
+        queries = rng.standard_normal((QUERIES, DIM), dtype=np.float32)
+        start = time.perf_counter()
+        for query in queries:
+            reloaded.search(query, K)
+        elapsed = time.perf_counter() - start
+        print(f"busca top-{K}: {elapsed / QUERIES * 1000:.2f} ms/consulta")
+
+
+if __name__ == "__main__":
+    main()
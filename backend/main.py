@@ -8,6 +8,13 @@ import os
 
 from app.routers import auth, emails, ai_agent
 from app.core.config import settings
+from app.core.database import get_connection, close_connection
+from app.core.mailbox import get_mailbox_stats
+from app.core.http_client import close_http_client
+from app.services.gmail_scheduler import gmail_scheduler
+from app.services.ai_service import AIService
+from app.services.analysis_cache import analysis_cache, insights_cache
+from app.services.response_cache import chat_response_cache
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -16,10 +23,14 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Iniciando Gmail AI Agent...")
+    get_connection()
+    app.state.ai_service = AIService()
     print("✅ Aplicação inicializada")
     yield
     # Shutdown
     print("🛑 Encerrando aplicação...")
+    await close_http_client()
+    close_connection()
 
 app = FastAPI(
     title="Gmail AI Agent",
@@ -56,6 +67,19 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/stats")
+async def cache_stats():
+    """Contadores dos caches em memória"""
+    ai_service = getattr(app.state, "ai_service", None)
+    return {
+        "ai": ai_service.get_stats() if ai_service else {},
+        "mailbox": get_mailbox_stats(),
+        "gmail": gmail_scheduler.get_stats(),
+        "analysis_cache": analysis_cache.get_stats(),
+        "insights_cache": insights_cache.get_stats(),
+        "chat_cache": chat_response_cache.get_stats()
+    }
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
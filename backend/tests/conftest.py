@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Permite importar o pacote app ao rodar o pytest a partir de backend/ ou da raiz
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
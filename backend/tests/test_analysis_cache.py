@@ -0,0 +1,51 @@
+"""
+Cache persistente de análises: leituras e escritas em lote, fora do event loop
+"""
+import asyncio
+
+import pytest
+
+from app.core import database
+from app.services.analysis_cache import AnalysisCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    database.close_connection()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'emails.db'))
+    yield AnalysisCache(namespace='teste', max_entries=100, ttl_seconds=3600, memory_entries=1)
+    database.close_connection()
+
+
+def test_put_many_and_get_many_round_trip(cache):
+    cache.put_many([('a', {'resumo': 'A'}), ('b', {'resumo': 'B'}), ('c', {'resumo': 'C'})])
+
+    # Só uma entrada cabe na memória: as outras vêm do SQLite
+    assert cache.get_many(['a', 'b', 'x']) == {'a': {'resumo': 'A'}, 'b': {'resumo': 'B'}}
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_async_accessors_run_off_the_loop(cache, monkeypatch):
+    threads = []
+    original = asyncio.to_thread
+
+    async def to_thread(function, *args):
+        threads.append(function.__name__)
+        return await original(function, *args)
+
+    monkeypatch.setattr(asyncio, 'to_thread', to_thread)
+
+    async def run():
+        await cache.aput_many([('a', {'resumo': 'A'}), ('b', {'resumo': 'B'})])
+        return await cache.aget_many(['a', 'b']), await cache.aget('a')
+
+    assert asyncio.run(run()) == ({'a': {'resumo': 'A'}, 'b': {'resumo': 'B'}}, {'resumo': 'A'})
+    # 'a' ficou na memória depois do get_many: aget não precisa de thread
+    assert threads == ['put_many', 'get_many']
+
+
+def test_expired_entries_are_dropped(cache):
+    cache.ttl_seconds = 0
+    cache.put('a', {'resumo': 'A'})
+
+    assert cache.get_many(['a']) == {}
@@ -0,0 +1,174 @@
+"""
+Busca de mensagens via batch HTTP contra um endpoint batch falso local
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import re
+import threading
+
+import pytest
+
+from app.core import http_client
+from app.core.config import settings
+from app.services import async_gmail_service
+from app.services.async_gmail_service import AsyncGmailService
+from app.services.gmail_scheduler import gmail_scheduler, GmailRateLimitError
+
+_SUBREQUEST_RE = re.compile(r'Content-ID: <([^>]+)>\r?\n\r?\nGET /gmail/v1/users/me/messages/(\w+)')
+
+
+def _message(message_id):
+    return {
+        'id': message_id,
+        'threadId': f't{message_id}',
+        'labelIds': ['INBOX', 'UNREAD'],
+        'snippet': f'snippet {message_id}',
+        'payload': {'headers': [
+            {'name': 'Subject', 'value': f'Assunto {message_id}'},
+            {'name': 'From', 'value': 'a@exemplo.com'},
+            {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:00:00 +0000'},
+        ]},
+    }
+
+
+class FakeGmail:
+    """Servidor local com messages.list e o endpoint batch; registra cada round trip"""
+
+    def __init__(self, total):
+        self.ids = [f'm{i:03d}' for i in range(total)]
+        self.round_trips = []
+        # id -> quantas vezes ainda responder 503 na subrequisição
+        self.failures = {}
+        # id -> Retry-After de uma única resposta 429 na subrequisição
+        self.throttled = {}
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type='application/json'):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                fake.round_trips.append(('GET', self.path, []))
+                self._reply(200, json.dumps({'messages': [{'id': m} for m in fake.ids]}))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                subrequests = _SUBREQUEST_RE.findall(body)
+                fake.round_trips.append(('POST', self.path, [m for _, m in subrequests]))
+                boundary = 'batch_resposta'
+                parts = []
+                for content_id, message_id in subrequests:
+                    headers = 'Content-Type: application/json\r\n'
+                    if message_id in fake.throttled:
+                        headers += f'Retry-After: {fake.throttled.pop(message_id)}\r\n'
+                        status, payload = '429 Too Many Requests', '{"error": "rateLimitExceeded"}'
+                    elif fake.failures.get(message_id, 0) > 0:
+                        fake.failures[message_id] -= 1
+                        status, payload = '503 Service Unavailable', '{"error": "backendError"}'
+                    else:
+                        status, payload = '200 OK', json.dumps(_message(message_id))
+                    parts.append(
+                        f'--{boundary}\r\nContent-Type: application/http\r\n'
+                        f'Content-ID: <response-{content_id}>\r\n\r\n'
+                        f'HTTP/1.1 {status}\r\n{headers}\r\n{payload}\r\n'
+                    )
+                self._reply(200, ''.join(parts) + f'--{boundary}--', f'multipart/mixed; boundary={boundary}')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def batches(self):
+        return [ids for method, _, ids in self.round_trips if method == 'POST']
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    def start(total):
+        fake = FakeGmail(total)
+        monkeypatch.setattr(async_gmail_service, 'GMAIL_API_URL', f'{fake.url}/gmail/v1/users/me')
+        monkeypatch.setattr(async_gmail_service, 'GMAIL_BATCH_URL', f'{fake.url}/batch/gmail/v1')
+        servers.append(fake.server)
+        return fake
+
+    servers = []
+    monkeypatch.setattr(settings, 'HTTP2_ENABLED', False)
+    monkeypatch.setattr(gmail_scheduler, 'backoff_base', 0.0)
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def _get_emails(max_results):
+    async def run():
+        try:
+            service = AsyncGmailService()
+            credentials = service.get_credentials_from_token({'access_token': 'token-teste'})
+            return await service.get_emails(credentials, max_results=max_results)
+        finally:
+            await http_client.close_http_client()
+    return asyncio.run(run())
+
+
+def test_get_emails_uses_one_batch_round_trip(fake_gmail):
+    fake = fake_gmail(50)
+
+    emails = _get_emails(50)
+
+    assert [email['id'] for email in emails] == fake.ids
+    # 1 messages.list + 1 batch, em vez de 51 chamadas
+    assert len(fake.round_trips) == 2
+    assert fake.batches() == [fake.ids]
+
+
+def test_batch_size_is_configurable(fake_gmail, monkeypatch):
+    monkeypatch.setattr(settings, 'GMAIL_BATCH_SIZE', 20)
+    fake = fake_gmail(50)
+
+    emails = _get_emails(50)
+
+    assert len(emails) == 50
+    assert sorted(len(ids) for ids in fake.batches()) == [10, 20, 20]
+    assert len(fake.round_trips) == 4
+
+
+def test_only_failed_subrequests_are_retried(fake_gmail):
+    fake = fake_gmail(30)
+    fake.failures = {'m003': 1, 'm017': 2}
+
+    emails = _get_emails(30)
+
+    assert [email['id'] for email in emails] == fake.ids
+    assert fake.batches() == [fake.ids, ['m003', 'm017'], ['m017']]
+
+
+def test_exhausted_retries_raise(fake_gmail, monkeypatch):
+    monkeypatch.setattr(settings, 'GMAIL_BATCH_MAX_RETRIES', 2)
+    fake = fake_gmail(5)
+    fake.failures = {'m001': 10}
+
+    with pytest.raises(GmailRateLimitError):
+        _get_emails(5)
+    assert fake.batches()[1:] == [['m001'], ['m001']]
+
+
+def test_retry_waits_for_the_largest_retry_after(fake_gmail, monkeypatch):
+    delays = []
+    monkeypatch.setattr(gmail_scheduler, 'backoff_delay', lambda attempt, retry_after=None: delays.append(retry_after) or 0.0)
+    fake = fake_gmail(10)
+    fake.throttled = {'m002': 1, 'm005': 3}
+
+    emails = _get_emails(10)
+
+    assert len(emails) == 10
+    assert fake.batches() == [fake.ids, ['m002', 'm005']]
+    assert delays == [3.0]
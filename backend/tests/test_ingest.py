@@ -0,0 +1,99 @@
+"""
+Ingestão: corpos baixados antes do índice e da análise
+"""
+import asyncio
+
+import pytest
+
+from app.core import database, mailbox
+from app.core.config import settings
+from app.services import ingest
+from app.services.ai_service import build_analysis_content
+from app.services.keyword_index import keyword_index
+from app.services.vector_index import text_hash
+
+
+def _email(index, body=None):
+    email = {
+        'id': f'm{index}',
+        'threadId': f't{index}',
+        'subject': f'Assunto {index}',
+        'sender': 'a@exemplo.com',
+        'date': f'Mon, {index + 1} Jan 2024 10:00:00 +0000',
+        'labels': ['INBOX'],
+        'snippet': f'snippet {index}',
+        'isRead': False,
+        'hasAttachments': False,
+    }
+    if body is None:
+        email.update(body='', bodyLoaded=False)
+    else:
+        email.update(body=body, bodyLoaded=True)
+    return email
+
+
+class FakeGmail:
+    def __init__(self):
+        self.requested = []
+
+    async def hydrate_bodies(self, credentials, emails):
+        self.requested.append([email['id'] for email in emails])
+        hydrated = [{**email, 'body': f"contrato de locação {email['id']}", 'bodyLoaded': True} for email in emails]
+        await asyncio.to_thread(database.save_emails, hydrated)
+        return hydrated
+
+
+class FakeAI:
+    def __init__(self):
+        self.analyzed = {}
+
+    async def index_emails(self, emails):
+        return {}
+
+    async def analyze_emails_packed(self, items, **kwargs):
+        for email_id, content in items:
+            self.analyzed[email_id] = content
+            yield {'email_id': email_id, 'status': 'ok', 'analysis': {
+                'resumo': '', 'sentimento': 'neutro', 'urgencia': 'baixa',
+                'categoria': 'trabalho', 'acoes_recomendadas': []
+            }}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    database.close_connection()
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'emails.db'))
+    monkeypatch.setattr(mailbox, '_view', None)
+    monkeypatch.setattr(ingest, '_credentials', None)
+    monkeypatch.setattr(keyword_index, 'refresh', lambda view: keyword_index)
+    yield
+    database.close_connection()
+
+
+def test_ingest_hydrates_recent_bodies_before_analysis(store, monkeypatch):
+    gmail = FakeGmail()
+    monkeypatch.setattr(ingest, 'gmail_service', gmail)
+    monkeypatch.setattr(settings, 'AI_INGEST_HYDRATE_MAX_ITEMS', 2)
+    database.save_emails([_email(i) for i in range(3)])
+
+    ai = FakeAI()
+    asyncio.run(ingest.ingest_mailbox(ai, credentials=object()))
+
+    # Os dois mais recentes ganham corpo; o terceiro fica para a próxima rodada
+    assert gmail.requested == [['m2', 'm1']]
+    assert sorted(ai.analyzed) == ['m1', 'm2']
+    stored = database.get_analysis_hashes()
+    for email_id in ('m1', 'm2'):
+        email = database.get_email_by_id(email_id)
+        assert 'contrato de locação' in ai.analyzed[email_id]
+        # Mesmo conteúdo que /ai/analyze-batch analisaria: não há segunda análise
+        assert stored[email_id] == text_hash(build_analysis_content(email))
+
+
+def test_ingest_without_credentials_skips_snippet_only_emails(store):
+    database.save_emails([_email(0), _email(1, body='corpo já baixado')])
+
+    ai = FakeAI()
+    asyncio.run(ingest.ingest_mailbox(ai))
+
+    assert list(ai.analyzed) == ['m1']
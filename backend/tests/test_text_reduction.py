@@ -0,0 +1,123 @@
+"""
+Heurísticas de remoção de assinatura, rodapés e histórico citado
+"""
+from app.services.text_reduction import strip_email_noise, reduce_thread
+
+
+def test_valediction_before_the_request_keeps_the_request():
+    text = 'Oi João,\nObrigado!\nPreciso do relatório Q3 até sexta, pode enviar?\nÉ urgente.'
+    assert strip_email_noise(text) == text
+
+
+def test_valediction_without_body_is_kept():
+    assert strip_email_noise('Obrigado!\nFulano') == 'Obrigado!\nFulano'
+
+
+def test_signature_after_valediction_is_removed():
+    text = (
+        'Oi Ana,\n\nSegue o relatório do trimestre em anexo.\n\n'
+        'Atenciosamente,\nFulano de Tal\nGerente de Projetos\n+55 11 99999-0000\nfulano@empresa.com.br'
+    )
+    assert strip_email_noise(text) == 'Oi Ana,\n\nSegue o relatório do trimestre em anexo.\n\nAtenciosamente,'
+
+
+def test_sentence_after_valediction_is_kept():
+    text = 'Segue o relatório.\nObrigado!\nPreciso também do fechamento de março.'
+    assert strip_email_noise(text) == text
+
+
+def test_confidential_word_in_body_is_kept():
+    text = 'Olá Ana,\n\nSegue em anexo o contrato confidencial para assinatura até amanhã.'
+    assert strip_email_noise(text) == text
+
+
+def test_unsubscribe_request_in_body_is_kept():
+    text = 'Hi,\n\nPlease unsubscribe me from this mailing list immediately.'
+    assert strip_email_noise(text) == text
+
+
+def test_confidentiality_notice_as_only_content_is_kept():
+    text = 'Olá,\n\nEsta mensagem é confidencial: não repasse o valor da proposta, R$ 10 mil até sexta.'
+    assert strip_email_noise(text) == text
+
+
+def test_disclaimer_after_signature_is_removed():
+    text = (
+        'Bom dia,\n\nA reunião foi remarcada para quinta às 15h.\n\n'
+        'Atenciosamente,\nFulano\n\n'
+        'Esta mensagem e seus anexos são confidenciais e destinados exclusivamente ao destinatário.'
+    )
+    assert strip_email_noise(text) == 'Bom dia,\n\nA reunião foi remarcada para quinta às 15h.\n\nAtenciosamente,'
+
+
+def test_footer_after_delimiter_is_removed():
+    text = (
+        'Novidades da semana: o novo painel de relatórios já está disponível.\n\n'
+        '***\n\n'
+        'You are receiving this email because you subscribed to our newsletter. To stop, visit the preferences page.'
+    )
+    assert strip_email_noise(text) == 'Novidades da semana: o novo painel de relatórios já está disponível.'
+
+
+def test_quoted_history_is_removed():
+    text = (
+        'Pode ser na quinta.\n\n'
+        'Em seg., 1 de jan. de 2024 às 10:00, Fulano <f@x.com>\nescreveu:\n> Podemos marcar a reunião?'
+    )
+    assert strip_email_noise(text) == 'Pode ser na quinta.'
+
+
+def test_thread_dedupes_repeated_paragraphs():
+    repeated = 'Parágrafo longo com o conteúdo original da primeira mensagem da thread.'
+    emails = [
+        {'id': '1', 'threadId': 't', 'body': repeated},
+        {'id': '2', 'threadId': 't', 'body': f'Resposta nova aqui.\n\n{repeated}'},
+    ]
+    assert [result.text for result in reduce_thread(emails)] == [repeated, 'Resposta nova aqui.']
+
+
+def test_document_link_is_kept():
+    text = 'Segue o link: https://docs.google.com/document/d/abc123/edit para revisão.'
+    assert strip_email_noise(text) == text
+
+
+def test_tracking_links_are_shortened():
+    text = (
+        'Confira a novidade: https://news.example.com/post?utm_source=email&utm_medium=newsletter\n'
+        'Ou aqui: https://click.mailer.example.com/ls/abc'
+    )
+    assert strip_email_noise(text) == 'Confira a novidade: [link news.example.com]\nOu aqui: [link click.mailer.example.com]'
+
+
+def test_em_anexo_and_em_breve_lines_are_kept():
+    text = 'Oi,\n\nEm anexo.\nEm breve o Carlos escreveu: vamos ver.\nAbs'
+    assert strip_email_noise(text) == text
+
+
+def test_quote_below_em_anexo_line_is_removed():
+    text = (
+        'Oi,\n\nEm anexo o contrato revisado.\nEm breve mando o resto.\n\n'
+        'Em ter., 2 de jan. de 2024 às 09:30, Fulano <f@x.com> escreveu:\n> Pode mandar o contrato?'
+    )
+    assert strip_email_noise(text) == 'Oi,\n\nEm anexo o contrato revisado.\nEm breve mando o resto.'
+
+
+def test_english_quote_header_is_removed():
+    text = 'Works for me.\n\nOn Mon, Jan 1, 2024 at 10:00 AM Fulano <f@x.com> wrote:\n> Shall we meet?'
+    assert strip_email_noise(text) == 'Works for me.'
+
+
+def test_bare_double_dash_divider_is_kept():
+    text = 'Reunião amanhã.\n--\nPauta:\n1. Orçamento\n2. Contratos'
+    assert strip_email_noise(text) == text
+
+
+def test_signature_after_rfc_delimiter_is_removed():
+    text = 'Reunião amanhã às 10h.\n-- \nFulano de Tal\nfulano@empresa.com.br'
+    assert strip_email_noise(text) == 'Reunião amanhã às 10h.'
+
+
+def test_mobile_signature_only_near_the_end():
+    text = 'Sent from my phone the first draft, sorry.\n' + '\n'.join(f'Item {i} da lista de pendências.' for i in range(10))
+    assert strip_email_noise(text) == text
+    assert strip_email_noise('Ok, fechado.\n\nEnviado do meu iPhone') == 'Ok, fechado.'
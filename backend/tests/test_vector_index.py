@@ -0,0 +1,19 @@
+"""
+Busca por similaridade no índice vetorial
+"""
+import numpy as np
+import pytest
+
+from app.services.vector_index import VectorIndex
+
+
+def test_search_does_not_modify_the_query_vector(tmp_path):
+    index = VectorIndex(str(tmp_path / 'vectors'))
+    index.upsert([('a', 'h1', [1.0, 0.0]), ('b', 'h2', [0.0, 1.0])])
+    query = np.array([3.0, 4.0], dtype=np.float32)
+
+    index.search(query, k=2)
+    index.scores_for(query, ['a', 'b'])
+
+    assert query.tolist() == [3.0, 4.0]
+    assert index.scores_for(query, ['a'])['a'] == pytest.approx(0.6)
@@ -73,6 +73,34 @@ export const EmailList = ({ token }: EmailListProps) => {
     }
   };
 
+  // A listagem traz só metadados; o corpo é buscado ao abrir o email
+  const openEmail = async (email: Email) => {
+    setSelectedEmail(email);
+    if (!email.isRead) markAsRead(email.id);
+    if (email.body) return;
+
+    try {
+      const response = await fetch(`http://localhost:8000/emails/${email.id}`, {
+        headers: {
+          'Authorization': `Bearer ${token}`,
+          'Content-Type': 'application/json'
+        }
+      });
+
+      if (response.ok) {
+        const full: Email = await response.json();
+        setEmails(current => current.map(item =>
+          item.id === full.id ? { ...item, body: full.body } : item
+        ));
+        setSelectedEmail(current =>
+          current?.id === full.id ? { ...current, body: full.body } : current
+        );
+      }
+    } catch (error) {
+      console.error('Erro ao carregar email:', error);
+    }
+  };
+
   const markAsRead = async (emailId: string) => {
     try {
       const response = await fetch(`http://localhost:8000/emails/${emailId}/read`, {
@@ -84,7 +112,7 @@ export const EmailList = ({ token }: EmailListProps) => {
       });
 
       if (response.ok) {
-        setEmails(emails.map(email =>
+        setEmails(current => current.map(email =>
           email.id === emailId ? { ...email, isRead: true } : email
         ));
       }
@@ -166,10 +194,7 @@ export const EmailList = ({ token }: EmailListProps) => {
                   <div
                     className={`p-4 hover:bg-gmail-secondary/50 cursor-pointer transition-colors ${selectedEmail?.id === email.id ? 'bg-gmail-primary/10' : ''
                       }`}
-                    onClick={() => {
-                      setSelectedEmail(email);
-                      if (!email.isRead) markAsRead(email.id);
-                    }}
+                    onClick={() => openEmail(email)}
                   >
                     <div className="flex items-start gap-3">
                       <div className="mt-1">